@@ -21,27 +21,19 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from __future__ import with_statement
-
+import functools
+import hashlib
+import itertools
 import os
+import subprocess
+import tempfile
 
-
-class UIDAllocator():
-    last_uid = None
-
-    def allocate_uid(self):
-        if self.last_uid is None:
-            self.last_uid = 0
-        else:
-            self.last_uid = self.last_uid + 1
-        return self.last_uid
-
-
-general_uidallocator = UIDAllocator()
-
-
-def allocate_general_uid():
-    return general_uidallocator.allocate_uid()
+try:
+    import cplex
+except ImportError:
+    # without the Python bindings CPLEXSession drives the interactive
+    # optimizer through LP files, like solve_using_CPLEX
+    cplex = None
 
 
 def parse_var(var):
@@ -53,42 +45,73 @@ def parse_var(var):
 
 
 class CPLEXRenderable():
+    __slots__ = ()
+
+    # composite renderables append their pieces via render_into, either
+    # to a list that render joins once or to a FileAppender
     def render(self):
+        out = []
+        self.render_into(out)
+        return ''.join(out)
+
+    def render_into(self, out):
         raise Exception('must override in subclass')
 
 
 class Expression(CPLEXRenderable):
+    __slots__ = ('terms_list',)
+
+    # terms_list may be any iterable of terms, e.g. an itertools.chain of
+    # several lists, so callers need not concatenate them first
     def __init__(self, terms_list=None):
+        if terms_list is None:
+            terms_list = []
+        elif not isinstance(terms_list, list):
+            terms_list = list(terms_list)
         self.terms_list = terms_list
-        if self.terms_list is None:
-            self.terms_list = []
 
     def __repr__(self):
         return "Expression(%s)" % repr(self.terms_list)
 
+    @classmethod
+    def from_arrays(cls, coeffs, variables):
+        # builds sum(coeffs[i] * variables[i]) with a single map over the
+        # two sequences; coeffs may be None when every coefficient is 1
+        if coeffs is None:
+            coeffs = itertools.repeat(None)
+        return cls(list(map(CoeffVar, coeffs, variables)))
+
     def add_term(self, term):
         self.terms_list.append(term)
 
     def is_negative(self):
         return self.terms_list[0].is_negative()
 
-    def render(self):
-        string_list = []
-        if len(self.terms_list) == 0:
-            print "warning: expression with empty terms_list"
-            return ''
-        string_list.append(self.terms_list[0].render())
-        for i in xrange(1, len(self.terms_list)):
-            if self.terms_list[i].is_negative():
-                string_list.append(' - %s' % self.terms_list[i].render_negation())
+    def render_into(self, out):
+        terms_list = self.terms_list
+        if len(terms_list) == 0:
+            print("warning: expression with empty terms_list")
+            return
+        # the whole expression is joined locally and handed to out as one
+        # piece, since out may be a file that pays for every write
+        pieces = []
+        append = pieces.append
+        terms_list[0].render_into(pieces)
+        for term in itertools.islice(terms_list, 1, None):
+            if term.__class__ is CoeffVar:
+                append(_render_signed_term(term.coeff, term.var))
+            elif term.is_negative():
+                append(' - ')
+                append(term.render_negation())
             else:
-                string_list.append(' + %s' % self.terms_list[i].render())
-        return ''.join(string_list)
+                append(' + ')
+                term.render_into(pieces)
+        out.append(''.join(pieces))
 
     def render_negation(self):
         string_list = []
         string_list.append(self.terms_list[0].render_negation())
-        for i in xrange(1, len(self.terms_list)):
+        for i in range(1, len(self.terms_list)):
             if self.terms_list[i].is_negative():
                 string_list.append(' - %s' % self.terms_list[i].render_negation())
             else:
@@ -101,59 +124,156 @@ class Expression(CPLEXRenderable):
 
 
 class Bound(CPLEXRenderable):
+    __slots__ = ('lb', 'var', 'ub')
+
     def __init__(self, var, lb=None, ub=None):
         self.lb = lb
         self.var = var
         self.ub = ub
         assert self.lb or self.ub
 
-    def render(self):
-        if self.lb and self.ub:
-            return '%s <= %s <= %s' % (self.lb.render(),
-                self.var.render(), self.ub.render())
-        elif self.lb:
-            return '%s <= %s' % (self.lb.render(), self.var.render())
-        return '%s <= %s' % (self.var.render(), self.ub.render())
+    def render_into(self, out):
+        if self.lb:
+            self.lb.render_into(out)
+            out.append(' <= ')
+        self.var.render_into(out)
+        if self.ub:
+            out.append(' <= ')
+            self.ub.render_into(out)
+
+
+def _bound_value(bound):
+    # a bound side reduced to a float, or None when the side is open
+    if bound is None:
+        return None
+    if isinstance(bound, Infinity):
+        return float('-inf') if bound.negative else float('inf')
+    if isinstance(bound, CoeffVar):
+        assert bound.var is None
+        return float(bound.coeff)
+    return float(bound)
+
+
+def _render_bound_value(value):
+    if value == float('inf'):
+        return '+inf'
+    if value == float('-inf'):
+        return '-inf'
+    return repr(value)
 
 
 class BoundsCollection(CPLEXRenderable):
-    def __init__(self, bounds=None):
-        self.bounds = bounds
-        if bounds is None:
-            self.bounds = []
+    # bounds are held column-wise as plain floats and variable names
+    # rather than as a list of Bound trees, so rendering is one format
+    # per bound
+    __slots__ = ('lbs', 'vars', 'ubs')
 
-    def render(self):
-        return '\n'.join([bound.render() for bound in self.bounds])
+    def __init__(self, bounds=None):
+        self.lbs = []
+        self.vars = []
+        self.ubs = []
+        if bounds is not None:
+            for bound in bounds:
+                self.add_bound(bound)
+
+    def __len__(self):
+        return len(self.vars)
+
+    def render_into(self, out):
+        append = out.append
+        for i, (lb, var, ub) in enumerate(zip(self.lbs, self.vars, self.ubs)):
+            if i:
+                append('\n')
+            if lb is None:
+                append('%s <= %s' % (var, _render_bound_value(ub)))
+            elif ub is None:
+                append('%s <= %s' % (_render_bound_value(lb), var))
+            else:
+                append('%s <= %s <= %s' % (_render_bound_value(lb), var,
+                                           _render_bound_value(ub)))
 
     def add_bound(self, bound=None, lb=None, var=None, ub=None):
-        if bound:
-            assert isinstance(bound)
-            self.bounds.append(bound)
-        else:
-            self.bounds.append(Bound(lb=lb, var=var, ub=ub))
+        if bound is None:
+            bound = Bound(lb=lb, var=var, ub=ub)
+        assert isinstance(bound, Bound)
+        var = bound.var
+        if isinstance(var, CPLEXRenderable):
+            var = var.render()
+        self.lbs.append(_bound_value(bound.lb))
+        self.vars.append(var)
+        self.ubs.append(_bound_value(bound.ub))
 
 
 class Constraint(CPLEXRenderable):
+    __slots__ = ('var_side', 'const_side', 'name')
+
     def __init__(self, var_side, const_side, name=None):
         self.var_side = var_side
         self.const_side = const_side
-        if name:
-            self.name = name
-        else:
-            self.name = 'c%d' % allocate_general_uid()
+        # unnamed constraints are numbered by their position when a
+        # ConstraintsCollection is rendered
+        self.name = name or None
+
+    def render_label_into(self, out, name=None):
+        if self.name is not None:
+            name = self.name
+        if name is not None:
+            out.append(name)
+            out.append(': ')
 
 
 class EqualityConstraint(Constraint):
-    def render(self):
-        return '%s: %s = %s' % (self.name, self.var_side.render(), self.const_side.render())
+    __slots__ = ()
+
+    def render_into(self, out, name=None):
+        self.render_label_into(out, name)
+        self.var_side.render_into(out)
+        out.append(' = ')
+        self.const_side.render_into(out)
 
 
 class InequalityConstraint(Constraint):
-    def render(self):
-        return '%s: %s <= %s' % (self.name, self.var_side.render(), self.const_side.render())
+    __slots__ = ()
+
+    def render_into(self, out, name=None):
+        self.render_label_into(out, name)
+        self.var_side.render_into(out)
+        out.append(' <= ')
+        self.const_side.render_into(out)
+
+
+def _render_term(coeff, var):
+    # coefficients are written as the shortest decimal that round-trips
+    # (e.g. 1.0 rather than 1.000000); unit and zero coefficients, which
+    # dominate 0-1 models, skip float formatting altogether
+    if coeff is None:
+        return '%s' % var
+    if coeff == 1:
+        return '%s' % var if var is not None else '1'
+    if coeff == -1:
+        return '-%s' % var if var is not None else '-1'
+    if coeff == 0:
+        return '0 %s' % var if var is not None else '0'
+    if var is None:
+        return '%r' % float(coeff)
+    return '%r %s' % (float(coeff), var)
+
+
+# the same (coefficient, variable) terms recur across many constraints,
+# e.g. a hospital's match terms in every stability constraint it is part
+# of, so their rendered form is cached
+@functools.lru_cache(maxsize=1 << 16)
+def _render_signed_term(coeff, var):
+    # a term that follows another: ' + term', or ' - ' and the negated
+    # term when its coefficient is negative
+    if coeff is not None and coeff < 0:
+        return ' - ' + _render_term(-coeff, var)
+    return ' + ' + _render_term(coeff, var)
 
 
 class CoeffVar(CPLEXRenderable):
+    __slots__ = ('coeff', 'var')
+
     def __init__(self, coeff=None, var=None):
         self.coeff = coeff
         self.var = var
@@ -165,24 +285,19 @@ class CoeffVar(CPLEXRenderable):
             repr(self.var) if self.var is not None else repr(None))
 
     def render(self):
-        if self.var is not None and self.coeff is not None:
-            return '%f %s' % (self.coeff, self.var)
-        elif self.var is not None:
-            return '%s' % self.var
-        return '%f' % self.coeff
+        return _render_term(self.coeff, self.var)
+
+    def render_into(self, out):
+        # leaf of every expression, so skip the render() call
+        out.append(_render_term(self.coeff, self.var))
 
     def render_negation(self):
-        if self.var and self.coeff:
-            return '%f %s' % (-self.coeff, self.var)
-        elif self.var:
+        if self.coeff is None:
             return '-%s' % self.var
-        return '%f' % -self.coeff
+        return _render_term(-self.coeff, self.var)
 
     def is_negative(self):
-        if self.var and not self.coeff:
-            return False
-        else:
-            return self.coeff < 0
+        return self.coeff is not None and self.coeff < 0
 
     def negate(self):
         if self.coeff is None:
@@ -193,6 +308,8 @@ class CoeffVar(CPLEXRenderable):
 
 
 class Infinity(CPLEXRenderable):
+    __slots__ = ('negative',)
+
     def __init__(self, negative=False):
         self.negative = negative
 
@@ -202,16 +319,24 @@ class Infinity(CPLEXRenderable):
         else:
             return '+inf'
 
+    def render_into(self, out):
+        out.append(self.render())
+
 
 class ConstraintsCollection(CPLEXRenderable):
+    __slots__ = ('constraints',)
+
     def __init__(self, constraints=None):
         self.constraints = constraints
         if constraints is None:
             self.constraints = []
-        general_uidallocator.last_uid = None
 
-    def render(self):
-        return '\n'.join([constraint.render() for constraint in self.constraints])
+    def render_into(self, out):
+        append = out.append
+        for i, constraint in enumerate(self.constraints):
+            if i:
+                append('\n')
+            constraint.render_into(out, 'c%d' % i)
 
     def add_constraint(self, constraint):
         self.constraints.append(constraint)
@@ -220,12 +345,56 @@ class ConstraintsCollection(CPLEXRenderable):
         self.constraints.extend(constraints)
 
 
-def generate_random_suffix(suffix):
-    import random
-    random_suffix = str(random.randint(0, 100000))
-    if suffix is not None:
-        random_suffix += str(suffix)
-    return random_suffix
+class FileAppender():
+    """Lets render_into write its pieces straight to a file object."""
+    __slots__ = ('append',)
+
+    def __init__(self, f):
+        self.append = f.write
+
+
+def _all_but_last(iterable):
+    previous = None
+    for i, item in enumerate(iterable):
+        if i:
+            yield previous
+        previous = item
+
+
+def _reserve_filename(prefix, suffix):
+    # the file is created here, so no other run can be handed the same name
+    fd, filename = tempfile.mkstemp(prefix=prefix, suffix=suffix,
+                                    dir=os.curdir)
+    os.close(fd)
+    return filename
+
+
+def cached_output(cache_dir, input_filename, run, key_extra='', keep=None):
+    """Returns the text run() produces for the solver input in
+    input_filename. The text is kept in cache_dir under a hash of the
+    input and key_extra, and later calls with an identical input return
+    it without calling run() again. Output for which keep(output) is false
+    is returned but not stored."""
+    key = hashlib.blake2b(key_extra.encode(), digest_size=16)
+    with open(input_filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            key.update(block)
+    path = os.path.join(cache_dir, key.hexdigest())
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            return f.read()
+    output = run()
+    if keep is not None and not keep(output):
+        return output
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # written under a temporary name first so that a concurrent run never
+    # reads a partial entry
+    fd, partial = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(output)
+    os.replace(partial, path)
+    return output
 
 
 def solve_using_CPLEX(objective,
@@ -234,64 +403,261 @@ def solve_using_CPLEX(objective,
     minimize=False, maximize=False, suffix=None,
     clean_files=True, treememory="1e+75",
     run_solver=True, solver_path=None,
-    problem_name='problem'):
-    if filename is None or solutionname is None:
-        random_suffix = generate_random_suffix(suffix)
+    problem_name='problem', cache_dir=None):
+    suffix = '' if suffix is None else str(suffix)
     if filename is None:
-        filename = '%s-%s.lp' % (problem_name, random_suffix)
-        while os.path.isfile(filename):
-            random_suffix = generate_random_suffix(suffix)
-            filename = '%s-%s.lp' % (problem_name, random_suffix)
-    if solutionname is None:
-        solutionname = 'output%s' % (random_suffix)
-    scriptname = 'script%s' % (random_suffix)
-    with open(scriptname, 'w') as script:
-        ## set some parameters before we solve things
-        script.write('set\nmip\nlimits\ntreememory\n%s\n' % treememory)
-        script.write('read %s\noptimize\ndisplay solution variables -\nquit' % filename)
+        filename = _reserve_filename('%s-' % problem_name, '%s.lp' % suffix)
     assert maximize or minimize
     assert not (maximize and minimize)
-    with open(filename, 'w') as f:
-        if maximize:
-            f.write('Maximize\n')
-        else:
-            f.write('Minimize\n')
-        f.write('obj: %s\n' % objective.render())
+    with open(filename, 'w', 1 << 20) as f:
+        # render straight into the buffered file so the LP is never held
+        # in memory as a whole
+        out = FileAppender(f)
+        out.append('Maximize\n' if maximize else 'Minimize\n')
+        out.append('obj: ')
+        objective.render_into(out)
+        out.append('\n')
         if constraints:
-            f.write('Subject To\n%s\n' % constraints.render())
+            out.append('Subject To\n')
+            constraints.render_into(out)
+            out.append('\n')
         if bounds:
-            f.write('Bounds\n%s\n' % bounds.render())
+            out.append('Bounds\n')
+            bounds.render_into(out)
+            out.append('\n')
         if binaries:
-            f.write('Binaries\n%s\n' % '\n'.join(binaries))
-        f.write('End')
-    if run_solver:
-        os.system('%s < %s > %s'
-            % (solver_path, scriptname, solutionname))
+            out.append('Binaries\n')
+            out.append(''.join([binary + '\n' for binary in binaries]))
+        out.append('End')
+    if not run_solver:
+        return None, None
+    if solutionname is None:
+        solutionname = _reserve_filename('output', suffix)
+    scriptname = _reserve_filename('script', suffix)
+    with open(scriptname, 'w') as script:
+        ## set some parameters before we solve things
+        script.write('set\nmip\nlimits\ntreememory\n%s\n' % treememory)
+        script.write('read %s\noptimize\ndisplay solution variables -\nquit' % filename)
+    try:
+        with open(scriptname, 'r') as script:
+            if cache_dir is None:
+                with open(solutionname, 'w') as solution:
+                    subprocess.check_call([solver_path], stdin=script,
+                                          stdout=solution)
+            else:
+                # the script names the scratch LP file, so only the
+                # settings it applies and the solver go into the key;
+                # CPLEX exits with 0 when it stops at a limit, so output
+                # without a solution is not kept
+                output = cached_output(
+                    cache_dir, filename, lambda: subprocess.run(
+                        [solver_path], stdin=script, stdout=subprocess.PIPE,
+                        universal_newlines=True, check=True).stdout,
+                    key_extra='treememory %s\nsolver %s\n'
+                    % (treememory, solver_path),
+                    keep=lambda output: ('Objective =' in output
+                                         and 'Variable Name' in output))
+                with open(solutionname, 'w') as solution:
+                    solution.write(output)
         vals = {}
         objective = None
-        with open(solutionname, 'r') as f:
-            lines = f.readlines()
-            startofvars = 0
-            for index, line in enumerate(lines):
+        # stream the solution rather than reading it all into memory;
+        # the variable table runs from the line after the 'Variable Name'
+        # header up to, but excluding, the last line of the file
+        with open(solutionname, 'r', 1 << 20) as f:
+            for line in f:
                 if 'Objective =' in line:
                     stripped = line.strip()
                     objective = float(stripped[stripped.find('Objective = ') + 12:])
                 if 'Variable Name' in line:
-                    startofvars = index + 1
                     break
-            if not startofvars:
+            else:
                 return None, None
-            lines = lines[startofvars:-1]
-            for line in lines:
-                split = line[:-1].split()
+            for line in _all_but_last(f):
                 if 'All other variables in the range' in line:
                     break
+                split = line.split()
                 try:
                     vals[split[0]] = float(split[1])
-                except:
+                except (IndexError, ValueError):
                     continue
-        if clean_files:
-            os.system('rm %s %s %s' % (filename, solutionname, scriptname))
         return objective, vals
+    finally:
+        if clean_files:
+            for path in (filename, solutionname, scriptname):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+def _linear_terms(renderable):
+    # (var, coeff) pairs and the constant term of a CoeffVar or an
+    # Expression of CoeffVars
+    if isinstance(renderable, Expression):
+        terms = renderable.terms_list
     else:
-        return None, None
+        terms = [renderable]
+    linear = []
+    constant = 0.
+    for term in terms:
+        coeff = 1. if term.coeff is None else float(term.coeff)
+        if term.var is None:
+            constant += coeff
+        else:
+            linear.append((term.var, coeff))
+    return linear, constant
+
+
+class CPLEXSession():
+    """A problem kept loaded between solves so that a family of related
+    problems only sends what changed.
+
+    With the cplex Python bindings, the model is built once, adding all
+    variables and all constraints in one batched call each, and every
+    solve warm-starts from the previous one. Without them, each solve
+    falls back to solve_using_CPLEX.
+    """
+    __slots__ = ('objective', 'constraints', 'bounds', 'binaries',
+                 'minimize', 'maximize', 'treememory', 'solver_path',
+                 'problem_name', 'problem')
+
+    def __init__(self, objective, constraints=None, bounds=None,
+                 binaries=None, minimize=False, maximize=False,
+                 treememory="1e+75", solver_path=None,
+                 problem_name='problem'):
+        assert maximize or minimize
+        assert not (maximize and minimize)
+        self.objective = objective
+        self.constraints = constraints
+        self.bounds = bounds
+        self.binaries = binaries
+        self.minimize = minimize
+        self.maximize = maximize
+        self.treememory = treememory
+        self.solver_path = solver_path
+        self.problem_name = problem_name
+        self.problem = None
+        if cplex is not None:
+            self.problem = self._build_problem()
+
+    def _constraint_names(self):
+        for i, constraint in enumerate(self.constraints.constraints):
+            yield constraint.name if constraint.name is not None else 'c%d' % i
+
+    def _build_problem(self):
+        columns = {}
+        obj = []
+
+        def column(var):
+            if var not in columns:
+                columns[var] = len(columns)
+                obj.append(0.)
+            return columns[var]
+
+        for var, coeff in _linear_terms(self.objective)[0]:
+            obj[column(var)] += coeff
+        rows = []
+        senses = []
+        rhs = []
+        if self.constraints:
+            for constraint in self.constraints.constraints:
+                # everything with a variable goes to the left, constants
+                # to the right, as the LP file reader would do
+                lhs, lhs_constant = _linear_terms(constraint.var_side)
+                rhs_terms, rhs_constant = _linear_terms(constraint.const_side)
+                row = {}
+                for var, coeff in lhs:
+                    row[column(var)] = row.get(column(var), 0.) + coeff
+                for var, coeff in rhs_terms:
+                    row[column(var)] = row.get(column(var), 0.) - coeff
+                rows.append(cplex.SparsePair(ind=list(row),
+                                             val=list(row.values())))
+                senses.append('E' if isinstance(constraint,
+                                                EqualityConstraint) else 'L')
+                rhs.append(rhs_constant - lhs_constant)
+        bounds = self.bounds or BoundsCollection()
+        for var in bounds.vars:
+            column(var)
+        binaries = self.binaries or []
+        for var in binaries:
+            column(var)
+        lb = [0.] * len(columns)
+        ub = [cplex.infinity] * len(columns)
+        for lower, var, upper in zip(bounds.lbs, bounds.vars, bounds.ubs):
+            if lower is not None:
+                lb[columns[var]] = max(lower, -cplex.infinity)
+            if upper is not None:
+                ub[columns[var]] = min(upper, cplex.infinity)
+        types = ['C'] * len(columns)
+        for var in binaries:
+            types[columns[var]] = 'B'
+        problem = cplex.Cplex()
+        problem.set_problem_name(self.problem_name)
+        problem.set_log_stream(None)
+        problem.set_results_stream(None)
+        problem.parameters.mip.limits.treememory.set(float(self.treememory))
+        problem.objective.set_sense(problem.objective.sense.maximize
+                                    if self.maximize
+                                    else problem.objective.sense.minimize)
+        problem.variables.add(obj=obj, lb=lb, ub=ub, names=list(columns),
+                              types=types if binaries else '')
+        if rows:
+            problem.linear_constraints.add(
+                lin_expr=rows, senses=senses, rhs=rhs,
+                names=list(self._constraint_names()))
+        return problem
+
+    def update(self, objective=None, rhs=None):
+        """Change objective coefficients, given as {var: coeff}, of
+        variables already in the problem, and constraint right-hand sides,
+        given as {constraint name: value}; unnamed constraints are named
+        c0, c1, ... by position. A right-hand side is the value after any
+        constant on the left has been moved to the right."""
+        objective = dict(objective or {})
+        rhs = rhs or {}
+        if self.problem is not None:
+            if objective:
+                self.problem.objective.set_linear(
+                    [(var, float(coeff)) for var, coeff in objective.items()])
+            if rhs:
+                self.problem.linear_constraints.set_rhs(
+                    [(name, float(value)) for name, value in rhs.items()])
+        # the trees are kept in step so the file-based path sees the same
+        # problem
+        for term in self.objective.terms_list:
+            if term.var in objective:
+                term.coeff = objective.pop(term.var)
+        for var, coeff in objective.items():
+            self.objective.add_term(CoeffVar(coeff=coeff, var=var))
+        if rhs:
+            for name, constraint in zip(self._constraint_names(),
+                                        self.constraints.constraints):
+                if name in rhs:
+                    # the left-hand constant stays where it is, so it is
+                    # added back to match what the bindings are given
+                    value = rhs[name]
+                    lhs_constant = _linear_terms(constraint.var_side)[1]
+                    if lhs_constant:
+                        value = value + lhs_constant
+                    constraint.const_side = CoeffVar(value)
+
+    def solve(self, **kwargs):
+        """Returns (objective value, {var: value}), or (None, None) when
+        no solution is found. Keyword arguments are passed on to
+        solve_using_CPLEX when the bindings are not available."""
+        if self.problem is None:
+            return solve_using_CPLEX(
+                self.objective, constraints=self.constraints,
+                bounds=self.bounds, binaries=self.binaries,
+                minimize=self.minimize, maximize=self.maximize,
+                treememory=self.treememory, solver_path=self.solver_path,
+                problem_name=self.problem_name, **kwargs)
+        try:
+            self.problem.solve()
+            names = self.problem.variables.get_names()
+            values = self.problem.solution.get_values()
+            return (self.problem.solution.get_objective_value(),
+                    dict(zip(names, values)))
+        except cplex.exceptions.CplexError:
+            return None, None
@@ -21,90 +21,181 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import functools
 import numpy
-import random
 import sys
 
-
-def rim_sample(ref_ranking, parameters, debug=False):
-    sample = []
-    sample.append(ref_ranking[0])
-    for i in range(1, len(ref_ranking)):
-        sample.insert(numpy.nonzero(
-            numpy.random.multinomial(n=1, pvals=parameters[i]))[0],
-            ref_ranking[i])
-    return sample
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional: without it the kernels below run as plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+def _cumulative_table(parameters):
+    return numpy.cumsum(numpy.asarray(parameters, dtype=numpy.float64),
+                        axis=1)
+
+
+def _insertion_positions(cdfs, n, num_samples):
+    # positions[s, i - 1] is where item i of the reference ranking is
+    # inserted in sample s, drawn by inverting the cdf in row i
+    uniforms = numpy.random.random((num_samples, n - 1))
+    positions = numpy.empty((num_samples, n - 1), dtype=numpy.int64)
+    for i in range(1, n):
+        positions[:, i - 1] = numpy.minimum(numpy.searchsorted(
+            cdfs[i, :i + 1], uniforms[:, i - 1], side='right'), i)
+    return positions
+
+
+@njit(cache=True)
+def _rim_orders(positions):
+    # orders[s, k] is the index into the reference ranking of the item
+    # that ends up in position k of sample s
+    num_samples = positions.shape[0]
+    n = positions.shape[1] + 1
+    orders = numpy.empty((num_samples, n), dtype=numpy.int64)
+    for s in range(num_samples):
+        orders[s, 0] = 0
+        for i in range(1, n):
+            position = positions[s, i - 1]
+            for k in range(i, position, -1):
+                orders[s, k] = orders[s, k - 1]
+            orders[s, position] = i
+    return orders
+
+
+# parameters is an (n, n) lower-triangular float64 table whose row i
+# holds the insertion probabilities of item i in its first i + 1 entries;
+# cdfs is its row-wise cumulative sum, computed here if not supplied
+def rim_sample_batch(ref_ranking, parameters, num_samples, debug=False,
+                     cdfs=None):
+    n = len(ref_ranking)
+    if n == 0:
+        return numpy.empty((num_samples, 0), dtype=numpy.int64)
+    if cdfs is None:
+        cdfs = _cumulative_table(parameters)
+    orders = _rim_orders(_insertion_positions(cdfs, n, num_samples))
+    return numpy.asarray(ref_ranking)[orders]
+
+
+def rim_sample(ref_ranking, parameters, debug=False, cdfs=None):
+    if len(ref_ranking) == 0:
+        return []
+    if cdfs is None:
+        cdfs = _cumulative_table(parameters)
+    order = _rim_orders(_insertion_positions(cdfs, len(ref_ranking), 1))[0]
+    return [ref_ranking[k] for k in order]
+
+
+def _dispersion_table(n, dispersion):
+    # row i holds the insertion probabilities for the (i + 1)th item of
+    # the reference ranking, i.e., only the first i + 1 entries are used
+    rows = numpy.arange(n)[:, numpy.newaxis]
+    cols = numpy.arange(n)[numpy.newaxis, :]
+    if dispersion == 1:
+        table = numpy.broadcast_to(1.0 / (rows + 1), (n, n)).copy()
+    else:
+        # only n + 1 distinct powers of the dispersion are ever needed
+        powers = dispersion ** numpy.arange(n + 1)
+        table = (powers[numpy.maximum(rows - cols, 0)] * (1 - dispersion)
+                 / (1 - powers[rows + 1]))
+    table[cols > rows] = 0.
+    return table
+
+
+# each entry holds two n x n tables, so only a handful are kept
+@functools.lru_cache(maxsize=8)
+def _cached_dispersion_tables(n, dispersion):
+    parameters = _dispersion_table(n, dispersion)
+    cdfs = _cumulative_table(parameters)
+    # the tables are shared between callers, so they must not change
+    parameters.flags.writeable = False
+    cdfs.flags.writeable = False
+    return parameters, cdfs
+
+
+def _dispersion_tables(n, dispersion, debug=False):
+    tables = _cached_dispersion_tables(n, dispersion)
+    if debug:
+        assert numpy.allclose(tables[1][:, -1], 1)
+    return tables
 
 
 def gen_dispersion_list(ref_ranking, dispersion, debug=False):
-    print "generating dispersion list, finished: ",
+    print("generating dispersion list, finished: ", end=' ')
     sys.stdout.flush()
-    parameters = {}
     if dispersion == 0:
         return ref_ranking
-    # have to translate to one-based indexing for the probabilities
-    for i in range(2, len(ref_ranking) + 1):
-        if i % 100 == 0:
-            print i,
-            sys.stdout.flush()
-        sample_prob = numpy.zeros(i)
-        for j in range(1, i + 1):
-            if dispersion == 1:
-                sample_prob[j - 1] = 1.0 / i
-            else:
-                sample_prob[j - 1] = (dispersion ** (i - j) *
-                    (1 - dispersion) / (1 - dispersion ** i))
-        if debug:
-            assert sum(sample_prob) == 1
-        parameters[i - 1] = sample_prob
-    print "finished generating."
-    return parameters
+    dispersion_list = _dispersion_tables(len(ref_ranking), dispersion,
+                                         debug=debug)
+    print("finished generating.")
+    return dispersion_list
 
 
+# a dispersion list is the (parameters, cdfs) pair of tables built by
+# gen_dispersion_list
 def mallows_sample(ref_ranking, dispersion_list, debug=False):
-    return rim_sample(ref_ranking=ref_ranking, parameters=dispersion_list, debug=debug)
+    parameters, cdfs = dispersion_list
+    return rim_sample(ref_ranking=ref_ranking, parameters=parameters,
+        debug=debug, cdfs=cdfs)
+
+
+def mallows_sample_batch(ref_ranking, dispersion_list, num_samples,
+                         debug=False):
+    parameters, cdfs = dispersion_list
+    return rim_sample_batch(ref_ranking=ref_ranking, parameters=parameters,
+        num_samples=num_samples, debug=debug, cdfs=cdfs)
 
 
 def mallows_sample_only_phi(ref_ranking, dispersion, debug=False):
-    parameters = {}
     if dispersion == 0:
         return ref_ranking
-    # have to translate to one-based indexing for the probabilities
-    for i in range(2, len(ref_ranking) + 1):
-        sample_prob = numpy.zeros(i)
-        for j in range(1, i + 1):
-            if dispersion == 1:
-                sample_prob[j - 1] = 1.0 / i
-            else:
-                sample_prob[j - 1] = (dispersion ** (i - j) *
-                    (1 - dispersion) / (1 - dispersion ** i))
-        if debug:
-            assert sum(sample_prob) == 1
-        parameters[i - 1] = sample_prob
+    parameters, cdfs = _dispersion_tables(len(ref_ranking), dispersion,
+                                          debug=debug)
     return rim_sample(ref_ranking=ref_ranking,
-        parameters=parameters, debug=debug)
+        parameters=parameters, debug=debug, cdfs=cdfs)
+
+
+@njit(cache=True)
+def _riffle_order(length1, length2, mixing_probability, uniforms):
+    # from_first[k] is True when position k of the sample is taken from
+    # the first ranking
+    from_first = numpy.empty(length1 + length2, dtype=numpy.bool_)
+    remaining1 = length1
+    remaining2 = length2
+    for k in range(length1 + length2):
+        if remaining1 == 0:
+            from_first[k] = False
+        elif remaining2 == 0 or uniforms[k] <= mixing_probability:
+            from_first[k] = True
+        else:
+            from_first[k] = False
+        if from_first[k]:
+            remaining1 -= 1
+        else:
+            remaining2 -= 1
+    return from_first
 
 
 def riffle_sample(ranking1, ranking2, sigma, debug=False):
     sample = []
-    r1copy = list(ranking1)
-    r2copy = list(ranking2)
-
-    r1copy.reverse()
-    r2copy.reverse()
-
-    mixing_probability = max(min(random.gauss(0.25, sigma) if random.randint(0, 1)
-        else random.gauss(0.75, sigma), 1.0), 0.0)
-    for i in range(len(r1copy) + len(r2copy)):
-        if len(r1copy) == 0 and len(r2copy) == 0:
-            raise Exception('problem')
-        if len(r1copy) == 0:
-            sample.append(r2copy.pop())
-            continue
-        if len(r2copy) == 0 or random.random() <= mixing_probability:
-            sample.append(r1copy.pop())
-            continue
-        sample.append(r2copy.pop())
+    next1 = 0
+    next2 = 0
+    mixing_probability = max(min(numpy.random.normal(
+        0.25 if numpy.random.randint(0, 2) else 0.75, sigma), 1.0), 0.0)
+    uniforms = numpy.random.random(len(ranking1) + len(ranking2))
+    for from_first in _riffle_order(len(ranking1), len(ranking2),
+                                    mixing_probability, uniforms):
+        if from_first:
+            sample.append(ranking1[next1])
+            next1 += 1
+        else:
+            sample.append(ranking2[next2])
+            next2 += 1
     return sample
 
 
@@ -24,12 +24,17 @@ WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
 
-from __future__ import with_statement
-
-import argparse
+import collections
 import cplex_py
+import functools
+import hashlib
+import itertools
+import multiprocessing
 import os
-import string
+import pickle
+import subprocess
+import tempfile
+import threading
 
 resident_dict = {}
 hospital_dict = {}
@@ -40,38 +45,6 @@ NIL_HOSPITAL_SYMBOL = "-1"
 TREEMEM_LIM = "12000"
 
 
-def combinations(iterable, r):
-    # combinations('ABCD', 2) --> AB AC AD BC BD CD
-    # combinations(range(4), 3) --> 012 013 023 123
-    pool = tuple(iterable)
-    n = len(pool)
-    if r > n:
-        return
-    indices = range(r)
-    yield tuple(pool[i] for i in indices)
-    while True:
-        for i in reversed(range(r)):
-            if indices[i] != i + n - r:
-                break
-        else:
-            return
-        indices[i] += 1
-        for j in range(i + 1, r):
-            indices[j] = indices[j - 1] + 1
-        yield tuple(pool[i] for i in indices)
-
-
-def product(*args, **kwds):
-    # product('ABCD', 'xy') --> Ax Ay Bx By Cx Cy Dx Dy
-    # product(range(2), repeat=3) --> 000 001 010 011 100 101 110 111
-    pools = map(tuple, args) * kwds.get('repeat', 1)
-    result = [[]]
-    for pool in pools:
-        result = [x + [y] for x in result for y in pool]
-    for prod in result:
-        yield tuple(prod)
-
-
 class UIDAllocator():
     def __init__(self, first_uid=None):
         self.last_uid = first_uid - 1
@@ -83,6 +56,12 @@ class UIDAllocator():
             self.last_uid = self.last_uid + 1
         return self.last_uid
 
+    def allocate_uids(self, count):
+        # a contiguous block of count uids, indexable like a list
+        first_uid = self.allocate_uid()
+        self.last_uid = first_uid + count - 1
+        return range(first_uid, first_uid + count)
+
 
 class PreferenceFunction():
     def get_all_dispreferred(self, uid):
@@ -101,25 +80,23 @@ class PreferenceFunction():
 class ListPreferenceFunction(PreferenceFunction):
     def __init__(self, internal_list):
         self.internal_list = internal_list
+        # uid -> position of its first occurrence in internal_list
+        self.rank = {}
+        for i, uid in enumerate(internal_list):
+            self.rank.setdefault(uid, i)
 
     # list assumed in decreasing preference order,
     # i.e., most preferred first
     def get_all_preferred(self, uid):
-        preferred = []
-        for agent in self.internal_list:
-            if agent == uid:
-                return preferred
-            preferred.append(agent)
-        raise Exception('uid not in preference list: %r; internal_list; %r'
-                        % (uid, self.internal_list))
+        if uid not in self.rank:
+            raise Exception('uid not in preference list: %r; internal_list; %r'
+                            % (uid, self.internal_list))
+        return self.internal_list[:self.rank[uid]]
 
     def get_all_dispreferred(self, uid):
-        dispreferred = []
-        for agent in reversed(self.internal_list):
-            if agent == uid:
-                return dispreferred
-            dispreferred.append(agent)
-        raise Exception('uid not in preference list')
+        if uid not in self.rank:
+            raise Exception('uid not in preference list')
+        return self.internal_list[:self.rank[uid]:-1]
 
     def get_all_weakly_preferred(self, uid):
         return self.get_all_preferred(uid=uid) + [uid]
@@ -128,7 +105,7 @@ class ListPreferenceFunction(PreferenceFunction):
         return self.internal_list
 
     def get_rank(self, uid):
-        return self.internal_list.index(uid)
+        return self.rank[uid]
 
 
 class JointPreferenceFunction():
@@ -153,48 +130,62 @@ class ListJointPreferenceFunction(JointPreferenceFunction):
         # list of tuples of size of joint agent
         self.internal_list = internal_list
         self.cardinality = cardinality
+        # tuple -> position of its first occurrence in internal_list
+        self.rank = {}
+        for i, item in enumerate(internal_list):
+            self.rank.setdefault(item, i)
+        # (assignment, indices) -> weakly preferred tuples; callers only
+        # read the returned lists, so they are shared
+        self.weakly_preferred_cache = {}
 
     def get_cardinality(self):
         return self.cardinality
 
     # indices are indices that must remained fixed
     def _check_suitability(self, assignment, to_test, indices):
-        suitable = True
-        for i, item in enumerate(to_test):
-            if i in indices and to_test[i] != assignment[i]:
-                suitable = False
-                break
-        return suitable
+        for i in indices:
+            if to_test[i] != assignment[i]:
+                return False
+        return True
 
     def get_all_dispreferred(self, assignment, indices):
-        dispreferred = []
-        for a in reversed(self.internal_list):
-            if a == assignment:
-                return dispreferred
-            if self._check_suitability(assignment=assignment,
-                                       to_test=a, indices=indices):
-                dispreferred.append(a)
-        raise Exception('uid not in preference list')
+        if assignment not in self.rank:
+            raise Exception('uid not in preference list')
+        indices = tuple(indices)
+        dispreferred = self.internal_list[:self.rank[assignment]:-1]
+        if not indices:
+            return dispreferred
+        return [a for a in dispreferred if self._check_suitability(
+            assignment=assignment, to_test=a, indices=indices)]
 
     def get_all_weakly_preferred(self, assignment, indices):
-        weakly_preferred = []
-        for a in self.internal_list:
-            if a == assignment:
-                weakly_preferred.append(a)
-                return weakly_preferred
-            if self._check_suitability(assignment=assignment,
-                                       to_test=a, indices=indices):
-                weakly_preferred.append(a)
-        raise Exception('uid not in preference list')
+        indices = tuple(indices)
+        key = (assignment, indices)
+        if key in self.weakly_preferred_cache:
+            return self.weakly_preferred_cache[key]
+        if assignment not in self.rank:
+            raise Exception('uid not in preference list')
+        weakly_preferred = self.internal_list[:self.rank[assignment] + 1]
+        if indices:
+            weakly_preferred = [a for a in weakly_preferred
+                                if self._check_suitability(
+                                    assignment=assignment, to_test=a,
+                                    indices=indices)]
+        self.weakly_preferred_cache[key] = weakly_preferred
+        return weakly_preferred
 
     def get_ordering(self):
         return self.internal_list
 
     def get_rank(self, item):
-        return self.internal_list.index(item)
+        return self.rank[item]
 
 
 class Agent():
+    # agents number in the tens of thousands on large instances, so none
+    # of them carry a __dict__
+    __slots__ = ('uid',)
+
     def __init__(self, uid):
         self.uid = uid
         assert self.uid is not None
@@ -203,13 +194,18 @@ class Agent():
         return self.uid
 
     def __eq__(self, other):
-        return self.uid == other.uid
+        return self is other or getattr(other, 'uid', None) == self.uid
 
 
 class SinglePreferrer(Agent):
+    __slots__ = ('preference_function', 'weakly_preferred_cache')
+
     def __init__(self, preference_function, uid):
         Agent.__init__(self, uid=uid)
         self.preference_function = preference_function
+        # the same prefixes are asked for many times while formulating;
+        # callers only read the returned lists, so they are shared
+        self.weakly_preferred_cache = {}
 
     def get_all_preferred(self, uid):
         return self.preference_function.get_all_preferred(uid=uid)
@@ -218,7 +214,10 @@ class SinglePreferrer(Agent):
         return self.preference_function.get_all_dispreferred(uid=uid)
 
     def get_all_weakly_preferred(self, uid):
-        return self.preference_function.get_all_weakly_preferred(uid=uid)
+        if uid not in self.weakly_preferred_cache:
+            self.weakly_preferred_cache[uid] = \
+                self.preference_function.get_all_weakly_preferred(uid=uid)
+        return self.weakly_preferred_cache[uid]
 
     def get_ordering(self):
         return self.preference_function.get_ordering()
@@ -228,6 +227,8 @@ class SinglePreferrer(Agent):
 
 
 class JointPreferrer(Agent):
+    __slots__ = ('preference_function', 'residents')
+
     def __init__(self, preference_function, uid, residents):
         Agent.__init__(self, uid=uid)
         self.preference_function = preference_function
@@ -259,6 +260,8 @@ class JointPreferrer(Agent):
 
 
 class Hospital(SinglePreferrer):
+    __slots__ = ('capacity',)
+
     def __init__(self, preference_function, uid, capacity=None):
         SinglePreferrer.__init__(self,
                                  preference_function=preference_function,
@@ -270,6 +273,8 @@ class Hospital(SinglePreferrer):
 
 
 class NilHospital(Hospital):
+    __slots__ = ()
+
     def __init__(self):
         Hospital.__init__(self, preference_function=None, uid=NIL_HOSPITAL_UID)
         self.capacity = 10
@@ -285,14 +290,25 @@ class NilHospital(Hospital):
 
 
 class Resident(SinglePreferrer):
+    __slots__ = ('couple', 'var_names')
+
     def __init__(self, uid, preference_function=None, couple=None):
         SinglePreferrer.__init__(self, preference_function=preference_function,
                                  uid=uid)
         resident_dict[self.uid] = self
         self.couple = couple
+        # MIP matching variable names, formatted once per ranked hospital
+        self.var_names = {}
+        if preference_function is not None:
+            self.var_names = dict(
+                (h_uid, 'x_%d,%d' % (self.uid, h_uid))
+                for h_uid in self.get_ordering() + [NIL_HOSPITAL_UID])
 
 
 class Couple(JointPreferrer):
+    __slots__ = ('ranked_hospitals', 'pairs_by_h0', 'pairs_by_h1', 'var_names',
+                 'other_member', 'size')
+
     def __init__(self, preference_function, uid, residents):
         JointPreferrer.__init__(self, preference_function=preference_function,
                                 uid=uid, residents=residents)
@@ -300,21 +316,35 @@ class Couple(JointPreferrer):
         couple_dict[uid] = self
         for resident in self.residents:
             resident.couple = self
+        self.other_member = {self.residents[0]: self.residents[1],
+                             self.residents[1]: self.residents[0]}
         r0_ranked = []
         r1_ranked = []
         for (h0, h1) in self.preference_function.get_ordering():
             r0_ranked.append(h0)
             r1_ranked.append(h1)
         self.ranked_hospitals = {}
-        self.ranked_hospitals[self.residents[0]] = list(set(r0_ranked))
-        self.ranked_hospitals[self.residents[1]] = list(set(r1_ranked))
+        # deduplicated in the order the couple first ranks each hospital
+        self.ranked_hospitals[self.residents[0]] = list(
+            dict.fromkeys(r0_ranked))
+        self.ranked_hospitals[self.residents[1]] = list(
+            dict.fromkeys(r1_ranked))
+        # ranked pairs, in order, that place each member at a hospital
+        self.pairs_by_h0 = collections.defaultdict(list)
+        self.pairs_by_h1 = collections.defaultdict(list)
+        for pair in self.preference_function.get_ordering():
+            self.pairs_by_h0[pair[0]].append(pair)
+            self.pairs_by_h1[pair[1]].append(pair)
+        # MIP matching variable names, formatted once per ranked pair
+        self.var_names = dict(
+            (pair, 'x_%d,%d,%d' % (self.uid, pair[0], pair[1]))
+            for pair in self.preference_function.get_ordering()
+            + [(NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)])
         self.size = 2
 
     def get_other_member(self, member):
-        assert member in self.residents
-        for person in self.residents:
-            if person != member:
-                return person
+        assert member in self.other_member
+        return self.other_member[member]
 
     def get_ranked_hospitals(self, member=None):
         if member is None:
@@ -336,40 +366,69 @@ class DIMACSClause(DIMACSConstraint):
         DIMACSConstraint.__init__(self, var_list=var_list)
 
     def render(self):
-        return ' '.join([str(var) for var in self.var_list]) + ' 0'
+        return ' '.join(map(str, self.var_list)) + ' 0'
 
 
 class ConstraintsBuffer():
-    def __init__(self, filename):
-        self.filename = filename
-        with open(self.filename, 'w') as f:
-            f.write('')
+    # clauses are rendered in batches and kept in memory until the whole
+    # formulation is written out, so they never round-trip through disk;
+    # until rendered, each clause is held as its bare sequence of literals
+    def __init__(self):
+        self.rendered = []
+        self.num_rendered = 0
         self.buffer_list = []
         self.buffer_size = 5000
 
+    def __len__(self):
+        return self.num_rendered + len(self.buffer_list)
+
+    def write_buffer(self):
+        if self.buffer_list:
+            self.rendered.append(''.join([
+                ' '.join(map(str, literals)) + ' 0\n'
+                for literals in self.buffer_list]))
+            self.num_rendered += len(self.buffer_list)
+        self.buffer_list = []
+
+    def append_clause(self, literals):
+        self.buffer_list.append(literals)
+        if len(self.buffer_list) > self.buffer_size:
+            self.write_buffer()
+
     def append(self, constraint):
-        if len(self.buffer_list) < self.buffer_size:
-            self.buffer_list.append(constraint)
-        else:
-            with open(self.filename, 'a') as f:
-                for item in self.buffer_list:
-                    f.write(item.render() + '\n')
-                f.write(constraint.render() + '\n')
-            self.buffer_list = []
+        self.append_clause(constraint.var_list)
 
     def flush(self, variable_registry=None):
-        with open(self.filename, 'a') as f:
-            for item in self.buffer_list:
-                f.write(item.render() + '\n')
-                if variable_registry is not None:
-                    print ' '.join([
-                        ('-' + variable_registry[abs(var)]
-                            if var < 0 else variable_registry[abs(var)])
-                        for var in item.var_list])
-        self.buffer_list = []
+        if variable_registry is not None:
+            for literals in self.buffer_list:
+                print(' '.join([
+                    ('-' + variable_registry[abs(var)]
+                        if var < 0 else variable_registry[abs(var)])
+                    for var in literals]))
+        self.write_buffer()
+
+    def lines(self):
+        self.flush()
+        for chunk in self.rendered:
+            for line in chunk.splitlines():
+                yield line
+
+    def write_to(self, f):
+        self.flush()
+        f.writelines(self.rendered)
 
 NIL_HOSPITAL = NilHospital()
 
+SAT_STATUS_LINES = ('s SATISFIABLE', 's UNSATISFIABLE')
+
+
+def check_sat_answer(returncode, status_found):
+    # SAT solvers exit with 10 when satisfiable and 20 when not; some exit
+    # with 0 instead, but still print an 's' status line
+    if returncode not in (10, 20) and not status_found:
+        raise Exception('SAT solver gave no answer (exit code %d)'
+                        % returncode)
+
 
 def load_matching_from_file(filename):
     matching = {}
@@ -409,17 +468,14 @@ class ProblemInstance():
             singles = []
             couples = []
             for line in f:
-                if (line.startswith('#') or line.startswith(' ')
-                        or line.startswith('\n') or line.startswith('\r')):
+                if not line or line[0] in '# \n\r':
                     continue
-                items = line.strip().split()
-                if line.startswith('r'):
+                items = line.split()
+                if line[0] == 'r':
                     if int(items[1]) in resident_dict:
                         raise Exception('duplicate resident: %d'
                                         % int(items[1]))
-                    rol = []
-                    for i in xrange(2, len(items)):
-                        rol.append(int(items[i]))
+                    rol = list(map(int, items[2:]))
                     # APPENDING nil so that when loading the match in for
                     # comparison purposes, we have a rank spot for
                     # the nil hospital
@@ -433,18 +489,16 @@ class ProblemInstance():
                                  preference_function=ListPreferenceFunction(
                                  internal_list=rol))
                     singles.append(s)
-                elif line.startswith('p'):
+                elif line[0] == 'p':
                     if int(items[1]) in hospital_dict:
                         raise Exception(
                             'duplicate program: %d' % int(items[1]))
-                    rol = []
-                    for i in xrange(3, len(items)):
-                        rol.append(int(items[i]))
+                    rol = list(map(int, items[3:]))
                     h = Hospital(uid=int(items[1]),
                                  preference_function=ListPreferenceFunction(
                                  internal_list=rol), capacity=int(items[2]))
                     hospitals.append(h)
-                elif line.startswith('c'):
+                elif line[0] == 'c':
                     if int(items[1]) in couple_dict:
                         raise Exception('duplicate couple: %d' % int(items[1]))
                     if int(items[2]) in resident_dict:
@@ -455,15 +509,11 @@ class ProblemInstance():
                         raise Exception(
                             'resident in couple %d already defined: %d'
                             % (int(items[1]), int(items[3])))
-                    rol = []
-                    for i in xrange(4, len(items)):
-                        if i % 2 != 0:
-                            continue
-                        rol.append((int(items[i]) if items[i]
-                                   != NIL_HOSPITAL_SYMBOL else
-                                   NIL_HOSPITAL_UID, int(items[i + 1]) if
-                                   items[i + 1] != NIL_HOSPITAL_SYMBOL
-                                   else NIL_HOSPITAL_UID))
+                    if len(items) % 2 != 0:
+                        raise Exception('line not readable: %s' % line)
+                    h_uids = [int(item) if item != NIL_HOSPITAL_SYMBOL
+                              else NIL_HOSPITAL_UID for item in items[4:]]
+                    rol = list(zip(h_uids[0::2], h_uids[1::2]))
                     # APPENDING nil so that when loading the match in for
                     # comparison purposes, we have a rank spot for the
                     # nil hospital
@@ -482,6 +532,38 @@ class ProblemInstance():
                     raise Exception('line not readable: %s' % line)
             return cls(hospitals=hospitals, singles=singles, couples=couples)
 
+    @classmethod
+    def from_file_cached(cls, filename, cache_dir):
+        # the parsed instance is pickled in cache_dir under the file's
+        # path, modification time and size, so rerunning on an unchanged
+        # file skips parsing
+        stat = os.stat(filename)
+        key = hashlib.blake2b(repr(
+            ('problem', os.path.abspath(filename), stat.st_mtime_ns,
+             stat.st_size)).encode(), digest_size=16)
+        path = os.path.join(cache_dir, key.hexdigest() + '.pickle')
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                problem = pickle.load(f)
+            # unpickling bypasses the constructors that fill the registries
+            for hospital in problem.hospitals:
+                hospital_dict[hospital.uid] = hospital
+            for single in problem.singles:
+                resident_dict[single.uid] = single
+            for couple in problem.couples:
+                couple_dict[couple.uid] = couple
+                for resident in couple.residents:
+                    resident_dict[resident.uid] = resident
+            return problem
+        problem = cls.from_file(filename)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, partial = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(problem, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, path)
+        return problem
+
     # a matching here is just a dictionary from resident_uid -> program_uid
     @staticmethod
     def print_matching(matching, filename, header=None):
@@ -501,208 +583,183 @@ class ProblemInstance():
 
     def solve_mip(self, solver, verbose=False, verify_file=None,
                   run_solver=True, problem_name='problem',
-                  output_filename=None):
+                  output_filename=None, cache_dir=None):
         constraints = cplex_py.ConstraintsCollection()
-        binaries = []
+        # binary variable names, deduplicated but kept in insertion order
+        # so the LP, and the objective built from its first entry, are
+        # deterministic
+        binaries = {}
+        # local names for everything the constraint loops below touch, so
+        # each use is a fast local lookup rather than a global or
+        # attribute one
+        hospitals_by_uid = hospital_dict
+        residents_by_uid = resident_dict
+        CoeffVar = cplex_py.CoeffVar
+        Expression = cplex_py.Expression
+        EqualityConstraint = cplex_py.EqualityConstraint
+        InequalityConstraint = cplex_py.InequalityConstraint
+
+        # the same (resident, hospital, coefficient) terms recur across
+        # many constraints, so each is built once and the CoeffVars are
+        # shared; callers only read the returned lists
+        expanded_match_vars = {}
 
         def expand_match_var(resident, h, coeff=1.):
+            key = (resident.uid, h.uid, coeff)
+            if key not in expanded_match_vars:
+                expanded_match_vars[key] = build_match_terms(resident, h,
+                                                             coeff)
+            return expanded_match_vars[key]
+
+        def build_match_terms(resident, h, coeff):
             if resident.couple is None:
-                return [cplex_py.CoeffVar(coeff=coeff, var='x_%d,%d' %
-                        (resident.uid, h.uid))]
+                # a hospital may rank a resident who does not rank it back
+                var = resident.var_names.get(h.uid)
+                if var is None:
+                    var = 'x_%d,%d' % (resident.uid, h.uid)
+                return [CoeffVar(coeff=coeff, var=var)]
             else:
                 if resident.couple.residents[0] == resident:
-                    return [cplex_py.CoeffVar(coeff=coeff,
-                            var=('x_%d,%d,%d' % (resident.couple.uid,
-                                                 h_uid_pair[0],
-                                                 h_uid_pair[1])))
-                            for h_uid_pair in filter(
-                                lambda x: x[0] == h.uid,
-                                resident.couple.get_ordering())]
+                    h_uid_pairs = resident.couple.pairs_by_h0.get(h.uid, [])
                 else:
-                    return [cplex_py.CoeffVar(coeff=coeff,
-                            var=('x_%d,%d,%d' % (resident.couple.uid,
-                                                 h_uid_pair[0],
-                                                 h_uid_pair[1])))
-                            for h_uid_pair in filter(
-                                lambda x: x[1] == h.uid,
-                                resident.couple.get_ordering())]
+                    h_uid_pairs = resident.couple.pairs_by_h1.get(h.uid, [])
+                return [CoeffVar(coeff=coeff,
+                        var=resident.couple.var_names[h_uid_pair])
+                        for h_uid_pair in h_uid_pairs]
+
+        # h's match terms for the residents it ranks, in rank order, are
+        # expanded at most once per coefficient, as far down h's list as
+        # has been asked for; the terms for the residents h weakly prefers
+        # to r are then a prefix of that list
+        match_terms_by_hospital = {}
+
+        def weakly_preferred_terms(h, r_uid, coeff=-1.):
+            if h.uid == NIL_HOSPITAL_UID:
+                return []
+            key = (h.uid, coeff)
+            if key not in match_terms_by_hospital:
+                match_terms_by_hospital[key] = ([], {}, iter(h.get_ordering()))
+            terms, prefix_ends, unexpanded = match_terms_by_hospital[key]
+            while r_uid not in prefix_ends:
+                r_prime = next(unexpanded, None)
+                if r_prime is None:
+                    break
+                terms.extend(expand_match_var(residents_by_uid[r_prime], h,
+                                              coeff=coeff))
+                prefix_ends.setdefault(r_prime, len(terms))
+            if r_uid not in prefix_ends:
+                raise Exception(
+                    'uid not in preference list: %r; internal_list; %r'
+                    % (r_uid, h.get_ordering()))
+            return terms[:prefix_ends[r_uid]]
 
         # matching constraints
         for resident in self.singles:
-            constraints.add_constraint(cplex_py.EqualityConstraint(
-                var_side=cplex_py.Expression(
-                    [cplex_py.CoeffVar(var='x_%d,%d' % (resident.uid, h_uid))
-                     for h_uid in (resident.get_ordering()
-                     + [NIL_HOSPITAL_UID])]),
-                const_side=cplex_py.CoeffVar(1.)))
-            binaries.extend(['x_%d,%d' % (resident.uid, h_uid) for h_uid in (
-                resident.get_ordering() + [NIL_HOSPITAL_UID])])
+            match_vars = [resident.var_names[h_uid] for h_uid in (
+                resident.get_ordering() + [NIL_HOSPITAL_UID])]
+            constraints.add_constraint(EqualityConstraint(
+                var_side=Expression.from_arrays(None, match_vars),
+                const_side=CoeffVar(1.)))
+            binaries.update(dict.fromkeys(match_vars))
         for couple in self.couples:
-            constraints.add_constraint(cplex_py.EqualityConstraint(
-                var_side=cplex_py.Expression([cplex_py.CoeffVar(
-                    var='x_%d,%d,%d' % (couple.uid, h_uid_pair[0],
-                                        h_uid_pair[1]))
-                    for h_uid_pair in (couple.get_ordering() + [
-                        (NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)])]),
-                const_side=cplex_py.CoeffVar(1.)))
-            binaries.extend(['x_%d,%d,%d' % (couple.uid, h_uid_pair[0],
-                                             h_uid_pair[1])
-                            for h_uid_pair in (couple.get_ordering() + [
-                                (NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)])])
+            match_vars = [couple.var_names[h_uid_pair]
+                          for h_uid_pair in (couple.get_ordering() + [
+                              (NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)])]
+            constraints.add_constraint(EqualityConstraint(
+                var_side=Expression.from_arrays(None, match_vars),
+                const_side=CoeffVar(1.)))
+            binaries.update(dict.fromkeys(match_vars))
         for h in self.hospitals:
-            var_side = []
             if len(h.get_ordering()) > 0:
-                for resident_uid in h.get_ordering():
-                    var_side.extend(expand_match_var(
-                        resident_dict[resident_uid], h))
-                constraints.add_constraint(cplex_py.InequalityConstraint(
-                    var_side=cplex_py.Expression(var_side),
-                    const_side=cplex_py.CoeffVar(h.capacity)))
-        # stability constraints
+                constraints.add_constraint(InequalityConstraint(
+                    var_side=Expression(itertools.chain.from_iterable(
+                        expand_match_var(residents_by_uid[resident_uid], h)
+                        for resident_uid in h.get_ordering())),
+                    const_side=CoeffVar(h.capacity)))
+        # stability constraints; nobody can be matched to a hospital with
+        # no capacity, so every constraint that only guards against a
+        # resident switching to one holds trivially and is skipped
         # singles
         for r in self.singles:
             ordering = r.get_ordering()
             for h_uid in ordering:
-                h = hospital_dict[h_uid]
-                var_side = []
-                for r_prime in h.get_all_weakly_preferred(r.uid):
-                    var_side.extend(expand_match_var(resident_dict[r_prime],
-                                    h, coeff=-1.))
-                constraints.add_constraint(cplex_py.InequalityConstraint(
-                    var_side=cplex_py.Expression(var_side + [
-                        cplex_py.CoeffVar(coeff=-h.capacity,
-                                          var='x_%d,%d' % (r.uid, p_prime_uid))
-                        for p_prime_uid in r.get_all_weakly_preferred(h.uid)]),
-                    const_side=cplex_py.CoeffVar(-h.capacity)))
+                h = hospitals_by_uid[h_uid]
+                if h.capacity == 0:
+                    continue
+                constraints.add_constraint(InequalityConstraint(
+                    var_side=Expression(itertools.chain(
+                        weakly_preferred_terms(h, r.uid),
+                        [CoeffVar(coeff=-h.capacity,
+                                  var=r.var_names[p_prime_uid])
+                         for p_prime_uid in r.get_all_weakly_preferred(
+                             h.uid)])),
+                    const_side=CoeffVar(-h.capacity)))
         # one member of a couple
         for couple in self.couples:
             ordering = couple.get_ranked_hospitals()
             r0 = couple.residents[0]
             r1 = couple.residents[1]
-            for number in xrange(len(ordering)):
-                h0 = hospital_dict[ordering[number][0]]
-                h1 = hospital_dict[ordering[number][1]]
+            for (h0_uid, h1_uid) in ordering:
+                h0 = hospitals_by_uid[h0_uid]
+                h1 = hospitals_by_uid[h1_uid]
+                if h0.capacity == 0 or h1.capacity == 0:
+                    continue
+                # the couple's weakly preferred pairs appear in both
+                # constraints, scaled by either capacity
+                wp_pairs = couple.get_all_weakly_preferred((h0.uid, h1.uid),
+                                                           [])
+                pair_terms_h0 = [CoeffVar(
+                    coeff=-h0.capacity,
+                    var=couple.var_names[h_prime_pair])
+                    for h_prime_pair in wp_pairs]
+                pair_terms_h1 = [CoeffVar(
+                    coeff=-h1.capacity,
+                    var=couple.var_names[h_prime_pair])
+                    for h_prime_pair in wp_pairs]
                 if not h0 == h1:
-                    var_side = []
-                    for r_prime in h0.get_all_weakly_preferred(r0.uid):
-                        var_side.extend(expand_match_var(
-                            resident_dict[r_prime], h0, coeff=-1.))
-                    constraints.add_constraint(cplex_py.InequalityConstraint(
-                        var_side=cplex_py.Expression([cplex_py.CoeffVar(
-                            coeff=-h0.capacity,
-                            var='x_%d,%d,%d' % (
-                                couple.uid, h_prime_pair[0], h_prime_pair[1]))
-                            for h_prime_pair in
-                            couple.get_all_weakly_preferred((h0.uid, h1.uid),
-                                                            [])]
-                            + var_side + expand_match_var(r1, h1,
-                                                          coeff=h0.capacity)),
-                        const_side=cplex_py.CoeffVar(0.)))
-                    var_side = []
-                    for r_prime in h1.get_all_weakly_preferred(r1.uid):
-                        var_side.extend(expand_match_var(
-                            resident_dict[r_prime], h1, coeff=-1.))
-                    constraints.add_constraint(cplex_py.InequalityConstraint(
-                        var_side=cplex_py.Expression([cplex_py.CoeffVar(
-                            coeff=-h1.capacity,
-                            var='x_%d,%d,%d' % (couple.uid, h_prime_pair[0],
-                                                h_prime_pair[1]))
-                            for h_prime_pair in
-                            couple.get_all_weakly_preferred((h0.uid, h1.uid),
-                                                            [])]
-                            + var_side + expand_match_var(r0, h0,
-                                                          coeff=h1.capacity)),
-                        const_side=cplex_py.CoeffVar(0.)))
+                    constraints.add_constraint(InequalityConstraint(
+                        var_side=Expression(itertools.chain(
+                            pair_terms_h0,
+                            weakly_preferred_terms(h0, r0.uid),
+                            expand_match_var(r1, h1, coeff=h0.capacity))),
+                        const_side=CoeffVar(0.)))
+                    constraints.add_constraint(InequalityConstraint(
+                        var_side=Expression(itertools.chain(
+                            pair_terms_h1,
+                            weakly_preferred_terms(h1, r1.uid),
+                            expand_match_var(r0, h0, coeff=h1.capacity))),
+                        const_side=CoeffVar(0.)))
                 else:
                     if h0.get_rank(r0.uid) < h0.get_rank(r1.uid):
                         # r0 preferred to r1
-                        var_side = []
-                        for r_prime in h1.get_all_weakly_preferred(r1.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime], h1, coeff=-1.))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    [cplex_py.CoeffVar(
-                                     coeff=-h0.capacity,
-                                     var='x_%d,%d,%d' % (couple.uid,
-                                                         h_prime_pair[0],
-                                                         h_prime_pair[1]))
-                                        for h_prime_pair in
-                                        couple.get_all_weakly_preferred(
-                                            (h0.uid, h1.uid), [])]
-                                    + var_side + expand_match_var(
-                                        r1, h1,
-                                        coeff=h0.capacity)),
-                                const_side=cplex_py.CoeffVar(0.)))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    [cplex_py.CoeffVar(coeff=-h1.capacity,
-                                     var='x_%d,%d,%d' % (couple.uid,
-                                                         h_prime_pair[0],
-                                                         h_prime_pair[1]))
-                                     for h_prime_pair in
-                                     couple.get_all_weakly_preferred((h0.uid,
-                                                                      h1.uid),
-                                                                     [])]
-                                    + var_side
-                                    + expand_match_var(r0, h0,
-                                                       coeff=h1.capacity)),
-                                const_side=cplex_py.CoeffVar(0.)))
+                        var_side = weakly_preferred_terms(h1, r1.uid)
                     else:
-                        var_side = []
-                        for r_prime in h0.get_all_weakly_preferred(r0.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime], h0, coeff=-1.))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    [cplex_py.CoeffVar(coeff=-h0.capacity,
-                                     var='x_%d,%d,%d' % (couple.uid,
-                                                         h_prime_pair[0],
-                                                         h_prime_pair[1]))
-                                     for h_prime_pair in
-                                     couple.get_all_weakly_preferred((h0.uid,
-                                                                      h1.uid),
-                                                                     [])]
-                                    + var_side + expand_match_var(
-                                        r1, h1, coeff=h0.capacity)),
-                                const_side=cplex_py.CoeffVar(0.)))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    [cplex_py.CoeffVar(coeff=-h1.capacity,
-                                     var='x_%d,%d,%d' % (couple.uid,
-                                                         h_prime_pair[0],
-                                                         h_prime_pair[1]))
-                                     for h_prime_pair in
-                                     couple.get_all_weakly_preferred((h0.uid,
-                                                                      h1.uid),
-                                                                     [])]
-                                    + var_side
-                                    + expand_match_var(r0, h0,
-                                                       coeff=h1.capacity)),
-                                const_side=cplex_py.CoeffVar(0.)))
+                        var_side = weakly_preferred_terms(h0, r0.uid)
+                    constraints.add_constraint(InequalityConstraint(
+                        var_side=Expression(itertools.chain(
+                            pair_terms_h0, var_side,
+                            expand_match_var(r1, h1, coeff=h0.capacity))),
+                        const_side=CoeffVar(0.)))
+                    constraints.add_constraint(InequalityConstraint(
+                        var_side=Expression(itertools.chain(
+                            pair_terms_h1, var_side,
+                            expand_match_var(r0, h0, coeff=h1.capacity))),
+                        const_side=CoeffVar(0.)))
             # also consider switch to (nil, nil)
-            constraints.add_constraint(cplex_py.InequalityConstraint(
-                var_side=cplex_py.Expression(
-                    [cplex_py.CoeffVar(coeff=-1.,
-                     var='x_%d,%d,%d' % (couple.uid,
-                                         h_prime_pair[0],
-                                         h_prime_pair[1]))
+            constraints.add_constraint(InequalityConstraint(
+                var_side=Expression(itertools.chain(
+                    [CoeffVar(coeff=-1., var=couple.var_names[h_prime_pair])
                      for h_prime_pair in couple.get_ordering() +
-                     [(NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)]]
-                    + expand_match_var(r1, NIL_HOSPITAL, coeff=1.)),
-                const_side=cplex_py.CoeffVar(0.)))
-            constraints.add_constraint(cplex_py.InequalityConstraint(
-                var_side=cplex_py.Expression(
-                    [cplex_py.CoeffVar(coeff=-1., var='x_%d,%d,%d' %
-                     (couple.uid, h_prime_pair[0], h_prime_pair[1]))
+                     [(NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)]],
+                    expand_match_var(r1, NIL_HOSPITAL, coeff=1.))),
+                const_side=CoeffVar(0.)))
+            constraints.add_constraint(InequalityConstraint(
+                var_side=Expression(itertools.chain(
+                    [CoeffVar(coeff=-1., var=couple.var_names[h_prime_pair])
                      for h_prime_pair in couple.get_ordering() +
-                     [(NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)]]
-                    + expand_match_var(r0, NIL_HOSPITAL, coeff=1.)),
-                const_side=cplex_py.CoeffVar(0.)))
+                     [(NIL_HOSPITAL_UID, NIL_HOSPITAL_UID)]],
+                    expand_match_var(r0, NIL_HOSPITAL, coeff=1.))),
+                const_side=CoeffVar(0.)))
         # both members of a couple switch
         for couple in self.couples:
             ordering = couple.get_ranked_hospitals()
@@ -711,129 +768,74 @@ class ProblemInstance():
             # need to find all hospitals that are ranked by the
             # 2nd member of a couple
             # note: could generate fewer alpha variables if intelligent
-            generated_alphas = {}
+            # (resident uid, hospital uid) -> alpha variable name
+            alpha_names = {}
             for (h0_uid, h1_uid) in ordering:
-                h0 = hospital_dict[h0_uid]
-                h1 = hospital_dict[h1_uid]
+                h0 = hospitals_by_uid[h0_uid]
+                h1 = hospitals_by_uid[h1_uid]
                 if (h0.capacity <= 1 or h0_uid == NIL_HOSPITAL_UID
                     or h1.capacity <= 1 or h1_uid == NIL_HOSPITAL_UID
-                    or (r1.uid, h1_uid) in generated_alphas
-                        or (r0.uid, h0_uid) in generated_alphas):
+                    or (r1.uid, h1_uid) in alpha_names
+                        or (r0.uid, h0_uid) in alpha_names):
                     continue
                 else:
-                    binaries.append('alpha_%d,%d' % (r1.uid, h1_uid))
-                    generated_alphas[(r1.uid, h1_uid)] = True
-                    var_side = []
-                    for r_prime in h1.get_all_weakly_preferred(r1.uid):
-                        var_side.extend(
-                            expand_match_var(resident_dict[r_prime], h1,
-                                             coeff=-1.))
-                    constraints.add_constraint(cplex_py.InequalityConstraint(
-                        var_side=cplex_py.Expression(var_side + [
-                            cplex_py.CoeffVar(coeff=h1.capacity,
-                                              var='alpha_%d,%d'
-                                              % (r1.uid, h1.uid))]),
-                        const_side=cplex_py.CoeffVar(coeff=0.)))
-            for number in xrange(len(ordering)):
-                h0 = hospital_dict[ordering[number][0]]
-                h1 = hospital_dict[ordering[number][1]]
+                    alpha_name = 'alpha_%d,%d' % (r1.uid, h1_uid)
+                    alpha_names[(r1.uid, h1_uid)] = alpha_name
+                    binaries[alpha_name] = None
+                    constraints.add_constraint(InequalityConstraint(
+                        var_side=Expression(itertools.chain(
+                            weakly_preferred_terms(h1, r1.uid),
+                            [CoeffVar(coeff=h1.capacity, var=alpha_name)])),
+                        const_side=CoeffVar(coeff=0.)))
+            for (h0_uid, h1_uid) in ordering:
+                h0 = hospitals_by_uid[h0_uid]
+                h1 = hospitals_by_uid[h1_uid]
                 if h0.capacity == 0 or h1.capacity == 0:
                     continue
+                # every variant shares the couple's own terms scaled by
+                # big_m; only the hospital-side tail and the rhs differ
                 if not h0 == h1:
-                    var_side = []
                     if (h1.uid != NIL_HOSPITAL_UID and h1.capacity > 1
                         and h0.uid != NIL_HOSPITAL_UID
                             and h0.capacity > 1):
-                        for r_prime in h0.get_all_weakly_preferred(r0.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime], h0, coeff=-1.))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    expand_match_var(r0, h0, -h0.capacity)
-                                    + expand_match_var(r1, h1, -h0.capacity)
-                                    + [cplex_py.CoeffVar(coeff=-h0.capacity,
-                                       var='x_%d,%d,%d' % (couple.uid,
-                                                           h_prime_pair[0],
-                                                           h_prime_pair[1]))
-                                       for h_prime_pair in
-                                       couple.get_all_weakly_preferred(
-                                           (h0.uid, h1.uid), [])]
-                                    + var_side
-                                    + [cplex_py.CoeffVar(coeff=-h0.capacity,
-                                       var='alpha_%d,%d' % (r1.uid, h1.uid))]),
-                                const_side=cplex_py.CoeffVar(-h0.capacity)))
+                        big_m = h0.capacity
+                        tail = (weakly_preferred_terms(h0, r0.uid),
+                                [CoeffVar(coeff=-big_m,
+                                          var=alpha_names[(r1.uid, h1.uid)])])
                     elif h1.uid == NIL_HOSPITAL_UID or h1.capacity == 1:
-                        for r_prime in h0.get_all_weakly_preferred(r0.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime], h0, coeff=-1.))
-                        for r_prime in h1.get_all_weakly_preferred(r1.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime],
-                                h1, coeff=-h0.capacity))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    expand_match_var(r0, h0, -h0.capacity)
-                                    + expand_match_var(r1, h1, -h0.capacity)
-                                    + [cplex_py.CoeffVar(coeff=-h0.capacity,
-                                       var='x_%d,%d,%d' % (couple.uid,
-                                                           h_prime_pair[0],
-                                                           h_prime_pair[1]))
-                                       for h_prime_pair in
-                                       couple.get_all_weakly_preferred(
-                                           (h0.uid, h1.uid), [])]
-                                    + var_side),
-                                const_side=cplex_py.CoeffVar(-h0.capacity)))
+                        big_m = h0.capacity
+                        tail = (weakly_preferred_terms(h0, r0.uid),
+                                weakly_preferred_terms(h1, r1.uid,
+                                                       coeff=-big_m))
                     elif h0.uid == NIL_HOSPITAL_UID or h0.capacity == 1:
-                        for r_prime in h1.get_all_weakly_preferred(r1.uid):
-                            var_side.extend(expand_match_var(resident_dict[
-                                r_prime], h1, coeff=-1.))
-                        for r_prime in h0.get_all_weakly_preferred(r0.uid):
-                            var_side.extend(expand_match_var(resident_dict[
-                                r_prime], h0, coeff=-h1.capacity))
-                        constraints.add_constraint(
-                            cplex_py.InequalityConstraint(
-                                var_side=cplex_py.Expression(
-                                    expand_match_var(r0, h0, -h1.capacity)
-                                    + expand_match_var(r1, h1, -h1.capacity)
-                                    + [cplex_py.CoeffVar(coeff=-h1.capacity,
-                                       var='x_%d,%d,%d' % (couple.uid,
-                                                           h_prime_pair[0],
-                                                           h_prime_pair[1]))
-                                       for h_prime_pair in
-                                       couple.get_all_weakly_preferred(
-                                           (h0.uid, h1.uid), [])]
-                                    + var_side),
-                                const_side=cplex_py.CoeffVar(-h1.capacity)))
+                        big_m = h1.capacity
+                        tail = (weakly_preferred_terms(h1, r1.uid),
+                                weakly_preferred_terms(h0, r0.uid,
+                                                       coeff=-big_m))
                     else:
                         raise Exception('should never get here')
+                    rhs = -big_m
                 else:
                     if h0.capacity == 1:
                         continue
-                    var_side = []
+                    big_m = h0.capacity
                     if h0.get_rank(r0.uid) < h0.get_rank(r1.uid):
                         # r0 preferred to r1
-                        for r_prime in h1.get_all_weakly_preferred(r1.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime], h1, coeff=-1.))
+                        tail = (weakly_preferred_terms(h1, r1.uid),)
                     else:
-                        for r_prime in h1.get_all_weakly_preferred(r0.uid):
-                            var_side.extend(expand_match_var(
-                                resident_dict[r_prime], h0, coeff=-1.))
-                    constraints.add_constraint(cplex_py.InequalityConstraint(
-                        var_side=cplex_py.Expression(
-                            expand_match_var(r0, h0, -h0.capacity)
-                            + expand_match_var(r1, h1, -h0.capacity)
-                            + [cplex_py.CoeffVar(coeff=-h0.capacity,
-                               var='x_%d,%d,%d' % (couple.uid,
-                                                   h_prime_pair[0],
-                                                   h_prime_pair[1]))
-                               for h_prime_pair in
-                               couple.get_all_weakly_preferred(
-                                   (h0.uid, h1.uid), [])]
-                            + var_side),
-                        const_side=cplex_py.CoeffVar(-h0.capacity + 1)))
+                        tail = (weakly_preferred_terms(h0, r0.uid),)
+                    rhs = -big_m + 1
+                constraints.add_constraint(InequalityConstraint(
+                    var_side=Expression(itertools.chain(
+                        expand_match_var(r0, h0, -big_m),
+                        expand_match_var(r1, h1, -big_m),
+                        [CoeffVar(coeff=-big_m,
+                                  var=couple.var_names[h_prime_pair])
+                         for h_prime_pair in
+                         couple.get_all_weakly_preferred(
+                             (h0.uid, h1.uid), [])],
+                        *tail)),
+                    const_side=CoeffVar(rhs)))
         if verify_file is not None:
             r_match_dict = {}
             c_match_dict = {}
@@ -842,9 +844,9 @@ class ProblemInstance():
                 for line in f:
                     if line.startswith('r '):
                         s = line.split()
-                        h = (hospital_dict[int(s[2])]
+                        h = (hospitals_by_uid[int(s[2])]
                              if int(s[2]) != -1 else NIL_HOSPITAL)
-                        r = resident_dict[int(s[1])]
+                        r = residents_by_uid[int(s[1])]
                         r_match_dict[r] = h
                         h_match_dict[h] = r
 
@@ -855,69 +857,53 @@ class ProblemInstance():
                 c_match_dict[couple] = (r_match_dict[couple.residents[0]],
                                         r_match_dict[couple.residents[1]])
 
+            # names of the x_ variables that are 1 under the matching being
+            # verified; every other x_ variable is 0
+            true_vars = set()
+            for r, h in r_match_dict.items():
+                if r.couple is None:
+                    true_vars.add('x_%d,%d' % (r.uid, h.uid))
+            for couple, (h0, h1) in c_match_dict.items():
+                true_vars.add('x_%d,%d,%d' % (couple.uid, h0.uid, h1.uid))
+
             def eval_cplex_constraint(constraint):
-                if isinstance(constraint, cplex_py.InequalityConstraint):
-                    total_left = 0
-                    for var in constraint.var_side.terms_list:
-                        if var.var.startswith('alpha'):
-                            return (True, 0.0)
-                        if var.var.startswith('x_'):
-                            s = var.var.split(',')
-                            s[0] = s[0][2:]
-                            if len(s) == 3:
-                                var_val = (1. if c_match_dict[
-                                    couple_dict[int(s[0])]]
-                                    == (hospital_dict[int(s[1])],
-                                        hospital_dict[int(s[2])]) else 0.)
-                            else:
-                                var_val = (1. if r_match_dict[
-                                    resident_dict[int(s[0])]]
-                                    == hospital_dict[int(s[1])] else 0.)
-                            total_left += (var.coeff * var_val
-                                           if var.coeff is not None
-                                           else var_val)
+                total_left = 0.
+                for var in constraint.var_side.terms_list:
+                    if var.var.startswith('alpha'):
+                        return (True, 0.0)
+                    if var.var in true_vars:
+                        total_left += (var.coeff if var.coeff is not None
+                                       else 1.)
+                if isinstance(constraint, InequalityConstraint):
                     return ((total_left <= constraint.const_side.coeff),
                             total_left)
-                if isinstance(constraint, cplex_py.EqualityConstraint):
-                    total_left = 0
-                    for var in constraint.var_side.terms_list:
-                        if var.var.startswith('alpha'):
-                            return (True, 0.0)
-                        if var.var.startswith('x_'):
-                            s = var.var.split(',')
-                            s[0] = s[0][2:]
-                            if len(s) == 3:
-                                var_val = (1. if c_match_dict[
-                                    couple_dict[int(s[0])]] ==
-                                    (hospital_dict[int(s[1])],
-                                     hospital_dict[int(s[2])]) else 0.)
-                            else:
-                                var_val = (1. if r_match_dict[
-                                    resident_dict[int(s[0])]]
-                                    == hospital_dict[int(s[1])] else 0.)
-                            total_left += (var.coeff * var_val
-                                           if var.coeff is not None
-                                           else var_val)
+                if isinstance(constraint, EqualityConstraint):
                     return ((total_left == constraint.const_side.coeff),
                             total_left)
             for constraint in constraints.constraints:
-                if not eval_cplex_constraint(constraint)[0]:
-                    print constraint.var_side
-                    print constraint.const_side
-                    print eval_cplex_constraint(constraint)[1]
+                (satisfied, total_left) = eval_cplex_constraint(constraint)
+                if not satisfied:
+                    print(constraint.var_side)
+                    print(constraint.const_side)
+                    print(total_left)
             return
+        binaries = list(binaries)
         if run_solver:
-            (objective, vals) = cplex_py.solve_using_CPLEX(
-                objective=cplex_py.Expression(
-                    terms_list=[cplex_py.CoeffVar(var=binaries[0])]),
+            # with the cplex Python bindings the constraints go to CPLEX in
+            # one batched call; without them this writes and solves an LP
+            # file just as solve_using_CPLEX does
+            (objective, vals) = cplex_py.CPLEXSession(
+                objective=Expression(
+                    terms_list=[CoeffVar(var=binaries[0])]),
                 constraints=constraints, binaries=binaries,
-                maximize=True, clean_files=True,
-                treememory=TREEMEM_LIM, run_solver=run_solver,
-                problem_name=problem_name, solver_path=solver)
+                maximize=True, treememory=TREEMEM_LIM,
+                problem_name=problem_name,
+                solver_path=solver).solve(clean_files=True,
+                                          cache_dir=cache_dir)
         else:
             (objective, vals) = cplex_py.solve_using_CPLEX(
-                objective=cplex_py.Expression(
-                    terms_list=[cplex_py.CoeffVar(var=binaries[0])]),
+                objective=Expression(
+                    terms_list=[CoeffVar(var=binaries[0])]),
                 constraints=constraints, binaries=binaries, maximize=True,
                 clean_files=True, treememory=TREEMEM_LIM,
                 run_solver=run_solver, problem_name=problem_name,
@@ -927,7 +913,8 @@ class ProblemInstance():
                 return
             else:
                 for val in vals:
-                    if vals[val] == 1. and val.startswith('x_'):
+                    # the bindings report unrounded values for binaries
+                    if round(vals[val]) == 1 and val.startswith('x_'):
                         s = val.split(',')
                         s[0] = s[0][2:]
                         if len(s) == 3:
@@ -945,98 +932,85 @@ class ProblemInstance():
                   problem_name='problem',
                   verbose=False, verify_file=None, run_solver=True,
                   output_filename=None,
-                  enumerate_all=False, find_RPopt=False):
+                  enumerate_all=False, find_RPopt=False, cache_dir=None):
         if verbose:
             for single in self.singles:
-                print 'Single %d prefs %s' % (single.uid, str(
-                    single.preference_function.internal_list))
+                print('Single %d prefs %s' % (single.uid, str(
+                    single.preference_function.internal_list)))
             for couple in self.couples:
-                print 'Couple %d prefs %s' % (couple.uid, str(
-                    couple.preference_function.internal_list))
+                print('Couple %d prefs %s' % (couple.uid, str(
+                    couple.preference_function.internal_list)))
                 for resident in couple.residents:
-                    print '    Resident %d' % (resident.uid)
+                    print('    Resident %d' % (resident.uid))
             for hospital in self.hospitals:
-                print 'Hospital %d capacity %d prefs %s' % (
+                print('Hospital %d capacity %d prefs %s' % (
                     hospital.uid,
                     hospital.capacity if hospital.capacity is not None else -1,
-                    str(hospital.preference_function.internal_list))
+                    str(hospital.preference_function.internal_list)))
 
+        # variable names are only needed to print clauses and solver output
+        name_variables = verbose or verify_file is not None
         variable_registry = {}
-        import random
-        random_suffix = random.randint(0, 100000)
-        constraints_buffer_filename = 'constraints_buffer-%d' % (random_suffix)
-        while os.path.isfile(constraints_buffer_filename):
-            random_suffix = random.randint(0, 100000)
-            constraints_buffer_filename = 'constraints_buffer-%d' % (
-                random_suffix)
-        if output_filename and not run_solver:
-            solver_input_filename = output_filename
-        else:
-            solver_input_filename = '%s-%d.sat' % (problem_name, random_suffix)
-        solver_output_filename = 'output-%d' % (random_suffix)
-        constraints = ConstraintsBuffer(filename=constraints_buffer_filename)
-        num_constraints = 0
+        # the (resident uid, hospital uid) pair each matching variable
+        # stands for, so solver output is read without parsing names
+        match_var_pairs = {}
+        constraints = ConstraintsBuffer()
+        add_clause = constraints.append_clause
         # this will keep track of the DIMACS number of each matching variable
         res_match = {}
         var_uid_allocator = UIDAllocator(first_uid=1)
 
-        # create numbers for all matching variables
+        # create numbers for all matching variables; each resident's
+        # variables are one contiguous block, ending with the variable that
+        # represents the nil hospital
         for resident in self.singles:
             assert resident not in res_match
-            res_match[resident] = {}
-            for hospital_uid in resident.get_ordering():
-                hospital = hospital_dict[hospital_uid]
-                res_match[resident][hospital] = \
-                    var_uid_allocator.allocate_uid()
-                variable_registry[res_match[resident][hospital]] = \
-                    'xr_%d,%d' % (resident.uid, hospital.uid)
-            res_match[
-                resident][NIL_HOSPITAL] = var_uid_allocator.allocate_uid()
-            variable_registry[res_match[resident][NIL_HOSPITAL]] = \
-                'xr_%d,%d' % (resident.uid, NIL_HOSPITAL_UID)
-            constraints.append(DIMACSClause([
-                res_match[resident][hospital_dict[h_uid]]
-                for h_uid in resident.get_ordering()]
-                + [res_match[resident][NIL_HOSPITAL]]))
+            hospitals = [hospital_dict[h_uid]
+                         for h_uid in resident.get_ordering()]
+            hospitals.append(NIL_HOSPITAL)
+            uids = var_uid_allocator.allocate_uids(len(hospitals))
+            res_match[resident] = dict(zip(hospitals, uids))
+            match_var_pairs.update(zip(uids, [
+                (resident.uid, h.uid) for h in hospitals]))
+            if name_variables:
+                for uid, h in zip(uids, hospitals):
+                    variable_registry[uid] = 'xr_%d,%d' % (resident.uid,
+                                                            h.uid)
+            add_clause([res_match[resident][h] for h in hospitals])
         for couple in self.couples:
             for resident in couple.residents:
                 assert resident not in res_match
-                res_match[resident] = {}
-                for h_uid in couple.get_ranked_hospitals(resident):
-                    h = hospital_dict[h_uid]
-                    res_match[resident][h] = \
-                        var_uid_allocator.allocate_uid()
-                    variable_registry[res_match[resident][h]] = \
-                        'xc_%d,%d,%d' % (couple.uid, resident.uid, h_uid)
+                hospitals = [hospital_dict[h_uid] for h_uid in
+                             couple.get_ranked_hospitals(resident)]
                 # all residents that are members of a couple
                 # have a matching variable that represents the nil hospital
-                res_match[
-                    resident][NIL_HOSPITAL] = var_uid_allocator.allocate_uid()
-                variable_registry[res_match[resident][NIL_HOSPITAL]] = \
-                    'xc_%d,%d,%d' % (couple.uid,
-                                     resident.uid,
-                                     NIL_HOSPITAL_UID)
-                constraints.append(DIMACSClause([
-                    res_match[resident][hospital_dict[h_uid]]
-                    for h_uid in couple.get_ranked_hospitals(resident)]
-                    + [res_match[resident][NIL_HOSPITAL]]))
-        # no resident can be assigned to two hospitals
+                hospitals.append(NIL_HOSPITAL)
+                uids = var_uid_allocator.allocate_uids(len(hospitals))
+                res_match[resident] = dict(zip(hospitals, uids))
+                match_var_pairs.update(zip(uids, [
+                    (resident.uid, h.uid) for h in hospitals]))
+                if name_variables:
+                    for uid, h in zip(uids, hospitals):
+                        variable_registry[uid] = 'xc_%d,%d,%d' % (
+                            couple.uid, resident.uid, h.uid)
+                add_clause([res_match[resident][h] for h in hospitals])
+        # no resident can be assigned to two hospitals; the pairs are
+        # taken over each resident's negated variables so that no lookups
+        # happen per clause
         for resident in self.singles:
-            for (h1_uid, h2_uid) in combinations(
-                    resident.get_ordering() + [NIL_HOSPITAL_UID], 2):
-                constraints.append(DIMACSClause(
-                    [-res_match[resident][hospital_dict[h1_uid]],
-                     -res_match[resident][hospital_dict[h2_uid]]]))
+            negated = [-uid for uid in res_match[resident].values()]
+            for pair in itertools.combinations(negated, 2):
+                add_clause(pair)
 
         # no member of a couple can be assigned to two hospitals
         for couple in self.couples:
             for resident in couple.residents:
-                for (h1_uid, h2_uid) in combinations(
-                    set(couple.get_ranked_hospitals(resident) +
-                        [NIL_HOSPITAL_UID]), 2):
-                    constraints.append(DIMACSClause(
-                        [-res_match[resident][hospital_dict[h1_uid]],
-                         -res_match[resident][hospital_dict[h2_uid]]]))
+                matches = res_match[resident]
+                negated = [-matches[hospital_dict[h_uid]] for h_uid in set(
+                    couple.get_ranked_hospitals(resident) +
+                    [NIL_HOSPITAL_UID])]
+                for pair in itertools.combinations(negated, 2):
+                    add_clause(pair)
 
         """
         counter variables
@@ -1048,69 +1022,44 @@ class ProblemInstance():
         q[program][number_counted][> program capacity + 1] doesn't exist
         q[program][number_counted][> number_counted] doesn't exist
         """
-        # expressed as q[h][i][j]
+        # expressed as q[h][i][j]; each q[h][i] is a contiguous block of
+        # uids, so the clauses below only ever index into two rows
         q = {}
         for h in self.hospitals:
             q[h] = {}
-            ordering = h.get_ordering()
-            for i in xrange(len(ordering) + 1):
-                if i == 0:
-                    continue
-                q[h][i] = {}
-                for j in xrange(min(i + 1, h.capacity + 2)):
-                    q[h][i][j] = var_uid_allocator.allocate_uid()
-                    variable_registry[q[h][i][j]] = \
-                        'q_%d,%d,%d' % (h.uid, i, j)
+            capacity = h.capacity
+            previous = None
+            for i, r_uid in enumerate(h.get_ordering(), 1):
+                # the matching variable of the ith resident h ranks
+                match_var = res_match[resident_dict[r_uid]][h]
+                row = var_uid_allocator.allocate_uids(min(i + 1, capacity + 2))
+                q[h][i] = row
+                if name_variables:
+                    for j, uid in enumerate(row):
+                        variable_registry[uid] = 'q_%d,%d,%d' % (h.uid, i, j)
                 if i == 1:
-                    constraints.append(DIMACSClause(
-                        [res_match[resident_dict[ordering[i - 1]]][h],
-                         q[h][i][0]]))
-                    constraints.append(DIMACSClause(
-                        [-res_match[resident_dict[ordering[i - 1]]][h],
-                         q[h][i][1]]))
-                    constraints.append(DIMACSClause(
-                        [-res_match[resident_dict[ordering[i - 1]]][h],
-                         -q[h][i][0]]))
-                    constraints.append(DIMACSClause(
-                        [res_match[resident_dict[ordering[i - 1]]][h],
-                         -q[h][i][1]]))
+                    add_clause([match_var, row[0]])
+                    add_clause([-match_var, row[1]])
+                    add_clause([-match_var, -row[0]])
+                    add_clause([match_var, -row[1]])
                 else:
-                    for j in xrange(min(i + 1, h.capacity + 2)):
-                        if j == 0:
-                            constraints.append(DIMACSClause(
-                                [-res_match[resident_dict[ordering[i - 1]]][h],
-                                 -q[h][i][0]]))
-                            constraints.append(DIMACSClause(
-                                [q[h][i - 1][0], -q[h][i][0]]))
-                            constraints.append(DIMACSClause(
-                                [res_match[resident_dict[ordering[i - 1]]][h],
-                                 -q[h][i - 1][0], q[h][i][0]]))
-                        elif j == i:
-                            constraints.append(DIMACSClause(
-                                [res_match[resident_dict[ordering[i - 1]]][h],
-                                 -q[h][i][j]]))
-                            constraints.append(DIMACSClause(
-                                [q[h][i - 1][j - 1], -q[h][i][j]]))
-                            constraints.append(DIMACSClause(
-                                [-res_match[resident_dict[ordering[i - 1]]][h],
-                                 -q[h][i - 1][j - 1], q[h][i][j]]))
+                    add_clause([-match_var, -row[0]])
+                    add_clause([previous[0], -row[0]])
+                    add_clause([match_var, -previous[0], row[0]])
+                    for j in range(1, len(row)):
+                        if j == i:
+                            add_clause([match_var, -row[j]])
+                            add_clause([previous[j - 1], -row[j]])
+                            add_clause([-match_var, -previous[j - 1], row[j]])
                         else:
-                            constraints.append(DIMACSClause(
-                                [-res_match[resident_dict[ordering[i - 1]]][h],
-                                 -q[h][i - 1][j - 1], q[h][i][j]]))
-                            constraints.append(DIMACSClause(
-                                [res_match[resident_dict[ordering[i - 1]]][h],
-                                 -q[h][i - 1][j], q[h][i][j]]))
-                            constraints.append(DIMACSClause(
-                                [res_match[resident_dict[ordering[i - 1]]][h],
-                                 q[h][i - 1][j], -q[h][i][j]]))
-                            constraints.append(DIMACSClause(
-                                [-res_match[resident_dict[ordering[i - 1]]][h],
-                                 q[h][i - 1][j - 1], -q[h][i][j]]))
+                            add_clause([-match_var, -previous[j - 1], row[j]])
+                            add_clause([match_var, -previous[j], row[j]])
+                            add_clause([match_var, previous[j], -row[j]])
+                            add_clause([-match_var, previous[j - 1], -row[j]])
                 # capacity constraints (assertions)
-                if i >= h.capacity + 1:
-                    constraints.append(DIMACSClause(
-                        [-q[h][i][h.capacity + 1]]))
+                if i >= capacity + 1:
+                    add_clause([-row[capacity + 1]])
+                previous = row
 
         """
         more auxiliary vars
@@ -1119,164 +1068,157 @@ class ProblemInstance():
         """
         cpref = {}
         for couple in self.couples:
-            cpref[couple] = {}
+            cpref[couple] = prefs = {}
+            r0_matches = res_match[couple.residents[0]]
+            r1_matches = res_match[couple.residents[1]]
             ordering = couple.get_ordering()
-            for number in xrange(len(ordering)):
-                h0 = hospital_dict[ordering[number][0]]
-                h1 = hospital_dict[ordering[number][1]]
-                cpref[couple][number] = var_uid_allocator.allocate_uid()
-                variable_registry[cpref[couple][number]] = \
-                    'cpref_%d,%d' % (couple.uid, number)
+            for number, (h0_uid, h1_uid) in enumerate(ordering):
+                h0 = hospital_dict[h0_uid]
+                h1 = hospital_dict[h1_uid]
+                prefs[number] = var_uid_allocator.allocate_uid()
+                if name_variables:
+                    variable_registry[prefs[number]] = \
+                        'cpref_%d,%d' % (couple.uid, number)
                 if number == 0:
-                    constraints.append(DIMACSClause(
-                        [-cpref[couple][number],
-                            res_match[couple.residents[0]][h0]]))
-                    constraints.append(DIMACSClause(
-                        [-cpref[couple][number],
-                            res_match[couple.residents[1]][h1]]))
-                    constraints.append(DIMACSClause(
-                        [cpref[couple][number],
-                            -res_match[couple.residents[0]][h0],
-                            -res_match[couple.residents[1]][h1]]))
+                    add_clause([-prefs[number], r0_matches[h0]])
+                    add_clause([-prefs[number], r1_matches[h1]])
+                    add_clause(
+                        [prefs[number], -r0_matches[h0], -r1_matches[h1]])
                 else:
-                    constraints.append(DIMACSClause(
-                        [-cpref[couple][number],
-                            cpref[couple][number - 1],
-                            res_match[couple.residents[0]][h0]]))
-                    constraints.append(DIMACSClause(
-                        [-cpref[couple][number],
-                            cpref[couple][number - 1],
-                            res_match[couple.residents[1]][h1]]))
-                    constraints.append(DIMACSClause(
-                        [cpref[couple][number],
-                            -cpref[couple][number - 1]]))
-                    constraints.append(DIMACSClause(
-                        [cpref[couple][number],
-                            -res_match[couple.residents[0]][h0],
-                            -res_match[couple.residents[1]][h1]]))
+                    add_clause(
+                        [-prefs[number], prefs[number - 1], r0_matches[h0]])
+                    add_clause(
+                        [-prefs[number], prefs[number - 1], r1_matches[h1]])
+                    add_clause([prefs[number], -prefs[number - 1]])
+                    add_clause(
+                        [prefs[number], -r0_matches[h0], -r1_matches[h1]])
 
             # special cpref for couple is matched to (nil, nil)
             number = len(ordering)
-            cpref[couple][number] = var_uid_allocator.allocate_uid()
-            variable_registry[cpref[couple][number]] = \
-                'cpref_%d,%d' % (couple.uid, number)
-            constraints.append(DIMACSClause(
-                [-cpref[couple][number],
-                    cpref[couple][number - 1],
-                    res_match[couple.residents[0]][NIL_HOSPITAL]]))
-            constraints.append(DIMACSClause(
-                [-cpref[couple][number],
-                    cpref[couple][number - 1],
-                    res_match[couple.residents[1]][NIL_HOSPITAL]]))
-            constraints.append(DIMACSClause(
-                [cpref[couple][number],
-                    -cpref[couple][number - 1]]))
-            constraints.append(DIMACSClause(
-                [cpref[couple][number],
-                    -res_match[couple.residents[0]][NIL_HOSPITAL],
-                    -res_match[couple.residents[1]][NIL_HOSPITAL]]))
+            prefs[number] = var_uid_allocator.allocate_uid()
+            if name_variables:
+                variable_registry[prefs[number]] = \
+                    'cpref_%d,%d' % (couple.uid, number)
+            add_clause(
+                [-prefs[number], prefs[number - 1],
+                    r0_matches[NIL_HOSPITAL]])
+            add_clause(
+                [-prefs[number], prefs[number - 1],
+                    r1_matches[NIL_HOSPITAL]])
+            add_clause([prefs[number], -prefs[number - 1]])
+            add_clause(
+                [prefs[number], -r0_matches[NIL_HOSPITAL],
+                    -r1_matches[NIL_HOSPITAL]])
 
         # each couple must be matched to one of
         # their ranked pairs or (nil, nil)
         for couple in self.couples:
-            constraints.append(DIMACSClause(
+            add_clause(
                 [cpref[couple][number] for number in
-                 xrange(len(couple.get_ordering()) + 1)]))
+                 range(len(couple.get_ordering()) + 1)])
 
         def append_q_vars(l, q_vars):
             l_copy = list(l)
-            for q_var in q_vars:
-                (hospital, resident, number) = q_var
-                if (not hospital == NIL_HOSPITAL
-                        and hospital.get_rank(resident.uid) >= number):
-                    l_copy.append(q[hospital][hospital.get_rank(
-                        resident.uid)][number])
+            for (hospital, resident, number) in q_vars:
+                if hospital == NIL_HOSPITAL:
+                    continue
+                rank = hospital.get_rank(resident.uid)
+                if rank >= number:
+                    l_copy.append(q[hospital][rank][number])
             return l_copy
 
-        # instability for singles
+        # instability; nobody can be matched to a hospital with no
+        # capacity, so every clause that only guards against a resident
+        # switching to one is always satisfied and is skipped
+        # singles
         for single in self.singles:
+            matches = res_match[single]
             for h_uid in single.get_ordering():
                 h = hospital_dict[h_uid]
-                constraints.append(DIMACSClause(
-                    append_q_vars([res_match[
-                        single][hospital_dict[uid]]
-                        for uid in single.get_all_weakly_preferred(
-                            h_uid)], [(h, single, h.capacity)])))
+                if h.capacity == 0:
+                    continue
+                add_clause(
+                    append_q_vars([matches[hospital_dict[uid]]
+                                   for uid in single.get_all_weakly_preferred(
+                                       h_uid)], [(h, single, h.capacity)]))
+
+        # each couple's ranked pairs as hospitals, shared by both of the
+        # blocks below
+        hospital_pairs = {}
+        for couple in self.couples:
+            hospital_pairs[couple] = [
+                (hospital_dict[h0_uid], hospital_dict[h1_uid])
+                for (h0_uid, h1_uid) in couple.get_ranked_hospitals()]
 
         # one member of a couple switches
         for couple in self.couples:
-            ordering = couple.get_ranked_hospitals()
+            ordering = hospital_pairs[couple]
             r0 = couple.residents[0]
             r1 = couple.residents[1]
-            for number in xrange(len(ordering)):
-                h0 = hospital_dict[ordering[number][0]]
-                h1 = hospital_dict[ordering[number][1]]
+            r0_matches = res_match[r0]
+            r1_matches = res_match[r1]
+            prefs = cpref[couple]
+            for number, (h0, h1) in enumerate(ordering):
+                if h0.capacity == 0 or h1.capacity == 0:
+                    continue
                 if not h0 == h1:
-                    constraints.append(DIMACSClause(
-                        append_q_vars([-res_match[r1][h1],
-                                      cpref[couple][number]],
-                                      [(h0, r0, h0.capacity)])))
-                    constraints.append(DIMACSClause(
-                        append_q_vars([-res_match[r0][h0],
-                                      cpref[couple][number]],
-                                      [(h1, r1, h1.capacity)])))
+                    add_clause(
+                        append_q_vars([-r1_matches[h1], prefs[number]],
+                                      [(h0, r0, h0.capacity)]))
+                    add_clause(
+                        append_q_vars([-r0_matches[h0], prefs[number]],
+                                      [(h1, r1, h1.capacity)]))
                 else:
                     if h0.get_rank(r0.uid) < h0.get_rank(r1.uid):
-                        constraints.append(DIMACSClause(
-                            append_q_vars([-res_match[r1][h1],
-                                          cpref[couple][number]],
+                        add_clause(
+                            append_q_vars([-r1_matches[h1], prefs[number]],
                                           [(h0, r0, h0.capacity),
-                                          (h1, r1, h1.capacity - 1)])))
-                        constraints.append(DIMACSClause(
-                            append_q_vars([-res_match[r0][h0],
-                                          cpref[couple][number]],
-                                          [(h1, r1, h1.capacity)])))
+                                          (h1, r1, h1.capacity - 1)]))
+                        add_clause(
+                            append_q_vars([-r0_matches[h0], prefs[number]],
+                                          [(h1, r1, h1.capacity)]))
                     else:
-                        constraints.append(DIMACSClause(
-                            append_q_vars([-res_match[r1][h1],
-                                          cpref[couple][number]],
-                                          [(h0, r0, h0.capacity)])))
-                        constraints.append(DIMACSClause(
-                            append_q_vars([-res_match[r0][h0],
-                                          cpref[couple][number]],
+                        add_clause(
+                            append_q_vars([-r1_matches[h1], prefs[number]],
+                                          [(h0, r0, h0.capacity)]))
+                        add_clause(
+                            append_q_vars([-r0_matches[h0], prefs[number]],
                                           [(h0, r0, h0.capacity - 1),
-                                          (h1, r1, h1.capacity)])))
+                                          (h1, r1, h1.capacity)]))
             # also consider switch to (nil, nil)
-            constraints.append(DIMACSClause(
-                [-res_match[r0][NIL_HOSPITAL], cpref[couple][len(ordering)]]))
-            constraints.append(DIMACSClause(
-                [-res_match[r1][NIL_HOSPITAL], cpref[couple][len(ordering)]]))
+            add_clause([-r0_matches[NIL_HOSPITAL], prefs[len(ordering)]])
+            add_clause([-r1_matches[NIL_HOSPITAL], prefs[len(ordering)]])
 
         # both members of a couple switch
         for couple in self.couples:
-            ordering = couple.get_ranked_hospitals()
+            ordering = hospital_pairs[couple]
             r0 = couple.residents[0]
             r1 = couple.residents[1]
-            for number in xrange(len(ordering)):
-                h0 = hospital_dict[ordering[number][0]]
-                h1 = hospital_dict[ordering[number][1]]
+            r0_matches = res_match[r0]
+            r1_matches = res_match[r1]
+            prefs = cpref[couple]
+            for number, (h0, h1) in enumerate(ordering):
                 if h0.capacity == 0 or h1.capacity == 0:
                     continue
                 if not h0 == h1:
-                    constraints.append(DIMACSClause(
-                        append_q_vars([res_match[r0][h0], res_match[r1][h1],
-                                      cpref[couple][number]],
+                    add_clause(
+                        append_q_vars([r0_matches[h0], r1_matches[h1],
+                                      prefs[number]],
                                       [(h0, r0, h0.capacity),
-                                       (h1, r1, h1.capacity)])))
+                                       (h1, r1, h1.capacity)]))
                 else:
                     if h0.capacity == 1:
                         continue
-                    constraints.append(DIMACSClause(
-                        append_q_vars([res_match[r0][h0], res_match[r1][h1],
-                                      cpref[couple][number]],
+                    add_clause(
+                        append_q_vars([r0_matches[h0], r1_matches[h1],
+                                      prefs[number]],
                                       [(h0, r0, h0.capacity),
                                        (h1, r1, h1.capacity),
                                        (h0, r0, h0.capacity - 1),
-                                       (h1, r1, h1.capacity - 1)])))
+                                       (h1, r1, h1.capacity - 1)]))
             # also, consider switch to (nil, nil)
-            constraints.append(DIMACSClause([res_match[r0][NIL_HOSPITAL],
-                                             res_match[r1][NIL_HOSPITAL],
-                                             cpref[couple][len(ordering)]]))
+            add_clause([r0_matches[NIL_HOSPITAL], r1_matches[NIL_HOSPITAL],
+                        prefs[len(ordering)]])
 
         if verbose:
             constraints.flush(variable_registry=variable_registry)
@@ -1301,8 +1243,8 @@ class ProblemInstance():
                             h_hash[h] = True
                             ordering = h.get_ordering()
                             found_match = False
-                            for i in xrange(1, len(ordering) + 1):
-                                if ordering[i - 1] == r.uid:
+                            for i, r_uid in enumerate(ordering, 1):
+                                if r_uid == r.uid:
                                     value_dict[q[h][i][1]] = True
                                     found_match = True
                                     continue
@@ -1313,7 +1255,7 @@ class ProblemInstance():
             for h in self.hospitals:
                 if h not in h_hash:
                     ordering = h.get_ordering()
-                    for i in xrange(1, len(ordering) + 1):
+                    for i in range(1, len(ordering) + 1):
                         value_dict[q[h][i][0]] = True
             for couple in self.couples:
                 ordering = couple.get_ordering()
@@ -1326,9 +1268,9 @@ class ProblemInstance():
                 if r1 not in r_match_dict:
                     r_match_dict[r1] = NIL_HOSPITAL
                     value_dict[res_match[r1][NIL_HOSPITAL]] = True
-                for number in xrange(len(ordering)):
-                    h0 = hospital_dict[ordering[number][0]]
-                    h1 = hospital_dict[ordering[number][1]]
+                for number, (h0_uid, h1_uid) in enumerate(ordering):
+                    h0 = hospital_dict[h0_uid]
+                    h1 = hospital_dict[h1_uid]
                     if h0 == r_match_dict[r0] and h1 == r_match_dict[r1]:
                         found_match = True
                     if found_match:
@@ -1344,97 +1286,129 @@ class ProblemInstance():
                         return True
                     if int(number) < 0 and not -int(number) in value_dict:
                         return True
-            with open(constraints.filename, 'r') as f:
-                for line in f:
-                    if not eval_str_clause(line):
-                        s = line.split()
-                        print [variable_registry[int(x)] if int(x) > 0
-                               else ("-" + variable_registry[-int(x)]
-                               if int(x) < 0 else None) for x in s]
+            for line in constraints.lines():
+                if not eval_str_clause(line):
+                    s = line.split()
+                    print([variable_registry[int(x)] if int(x) > 0
+                           else ("-" + variable_registry[-int(x)]
+                           if int(x) < 0 else None) for x in s])
             return
         count = 0
         extra_constraints = []
         keep_searching = True
         while keep_searching:
-            constraints.flush()
-            num_constraints = 0
-            with open(constraints.filename, 'r') as f:
-                for line in f:
-                    if all(c in string.whitespace for c in line):
-                        continue
-                    num_constraints += 1
-            num_constraints += len(extra_constraints)
-            with open(solver_input_filename, 'w') as problem:
+            num_constraints = len(constraints) + len(extra_constraints)
+            def write_formulation(problem):
                 problem.write('p cnf %s %s\n' % (
                     var_uid_allocator.last_uid, num_constraints))
-                with open(constraints.filename, 'r') as f:
-                    for line in f:
-                        if all(c in string.whitespace for c in line):
-                            continue
-                        problem.write(line)
-                for constraint in extra_constraints:
-                    problem.write(constraint.render() + '\n')
-            if not run_solver:
-                return
-            os.system('%s %s > %s' % (
-                solver, solver_input_filename, solver_output_filename))
-            if verbose:
-                with open(solver_output_filename, 'r') as f:
-                    for line in f:
+                constraints.write_to(problem)
+                problem.write(''.join([constraint.render() + '\n'
+                                       for constraint in extra_constraints]))
+            if run_solver and cache_dir is None:
+                # the formulation is streamed to the solver, which reads
+                # DIMACS from standard input, without going through a file;
+                # it is fed from a thread so that the solver's output is
+                # read as it arrives and neither side can block the other
+                proc = subprocess.Popen(
+                    [solver], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                    universal_newlines=True, bufsize=1 << 20)
+                write_errors = []
+                def feed_solver():
+                    try:
+                        with proc.stdin:
+                            write_formulation(proc.stdin)
+                    except OSError as e:
+                        write_errors.append(e)
+                writer = threading.Thread(target=feed_solver)
+                writer.start()
+                solver_output = proc.stdout
+            else:
+                if output_filename and not run_solver:
+                    solver_input_filename = output_filename
+                    problem = open(solver_input_filename, 'w')
+                else:
+                    fd, solver_input_filename = tempfile.mkstemp(
+                        prefix='%s-' % problem_name, suffix='.sat',
+                        dir=os.curdir)
+                    problem = os.fdopen(fd, 'w')
+                with problem:
+                    write_formulation(problem)
+                if not run_solver:
+                    return
+                def run_sat_solver():
+                    with open(solver_input_filename) as problem:
+                        result = subprocess.run(
+                            [solver], stdin=problem, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+                    # only a conclusive answer may be cached, so a failed
+                    # run raises before its output is kept
+                    check_sat_answer(result.returncode, any(
+                        line.strip() in SAT_STATUS_LINES
+                        for line in result.stdout.splitlines()))
+                    return result.stdout
+                try:
+                    solver_output = cplex_py.cached_output(
+                        cache_dir, solver_input_filename, run_sat_solver,
+                        key_extra='solver %s\n' % solver).splitlines()
+                finally:
+                    os.unlink(solver_input_filename)
+            # the output is parsed in a single pass, one line at a time
+            matching_found = True
+            model_found = False
+            status_found = False
+            matching = {}
+            parsed = False
+            try:
+                for line in solver_output:
+                    if verbose:
                         s = line.split()
                         if len(s) == 1:
-                            print s
+                            print(s)
                         else:
                             for var_str in s:
                                 if var_str != '0':
-                                    print '%s: %s' % (
+                                    print('%s: %s' % (
                                         variable_registry[abs(int(var_str))],
-                                        '1' if int(var_str) > 0 else '0')
-            matching_found = True
-            with open(solver_output_filename, 'r') as f:
-                for line in f:
+                                        '1' if int(var_str) > 0 else '0'))
+                    if line.strip() in SAT_STATUS_LINES:
+                        status_found = True
                     if "UNSATISFIABLE" in line:
                         matching_found = False
-                        break
+                    elif line.startswith('v'):
+                        model_found = True
+                        for var_str in line.split()[1:]:
+                            var = int(var_str)
+                            if var > 0 and var in match_var_pairs:
+                                r_uid, h_uid = match_var_pairs[var]
+                                matching[r_uid] = h_uid
+                parsed = True
+            finally:
+                if cache_dir is None:
+                    # if parsing failed the solver may still be running,
+                    # and the writer blocked on it
+                    proc.stdout.close()
+                    if not parsed and proc.poll() is None:
+                        proc.kill()
+                    proc.wait()
+                    writer.join()
+            if cache_dir is None:
+                if write_errors:
+                    raise Exception('SAT solver gave no answer (exit code %d)'
+                                    % proc.returncode) from write_errors[0]
+                check_sat_answer(proc.returncode, status_found)
             if matching_found:
-                self.matching = {}
-                with open(solver_output_filename, 'r') as f:
-                    for line in f:
-                        if line.startswith('v'):
-                            s = line.split()
-                            for var_str in s[1:]:
-                                if var_str != '0':
-                                    var_name = variable_registry[
-                                        abs(int(var_str))]
-                                    if var_name.startswith('xr'):
-                                        if int(var_str) > 0:
-                                            self.matching[
-                                                int(var_name[
-                                                    3:var_name.find(',')])] \
-                                                = int(var_name[
-                                                    var_name.find(',')
-                                                    + 1:len(var_name)])
-                                    elif var_name.startswith('xc'):
-                                        if int(var_str) > 0:
-                                            self.matching[
-                                                int(var_name.split(
-                                                    ',')[1])] = int(
-                                                        var_name.split(',')[2])
-                            for single in self.singles:
-                                if single.uid not in self.matching:
-                                    self.matching[
-                                        single.uid] = NIL_HOSPITAL_UID
+                if model_found:
+                    for single in self.singles:
+                        if single.uid not in matching:
+                            matching[single.uid] = NIL_HOSPITAL_UID
+                self.matching = matching
             assert not matching_found or self.matching
-            if not matching_found:
-                os.system('rm %s' % constraints_buffer_filename)
-            os.system('rm %s %s' % (solver_input_filename,
-                                    solver_output_filename))
             if find_RPopt:
                 if not matching_found and count == 0:
-                    print "Search for resident-optimal matching failed because there were no stable matchings"
+                    print("Search for resident-optimal matching failed because there were no stable matchings")
                     return "Search for resident-optimal matching failed because there were no stable matchings"
                 if not matching_found:
-                    print "Generated stable matchings to find resident-optimal: %d" % count
+                    print("Generated stable matchings to find resident-optimal: %d" % count)
                     return "Generated stable matchings to find resident-optimal: %d" % count
                 ProblemInstance.print_matching(self.matching, '%s-opt%d' % (output_filename, count))
                 count += 1
@@ -1454,10 +1428,10 @@ class ProblemInstance():
                     [-res_match[resident_dict[r_uid]][hospital_dict[self.matching[r_uid]]] for r_uid in self.matching]))
             elif enumerate_all:
                 if not matching_found and count == 0:
-                    print "Matchings found: 0"
+                    print("Matchings found: 0")
                     return "Matchings found: 0"
                 if not matching_found:
-                    print "Matchings found: %d" % count
+                    print("Matchings found: %d" % count)
                     return "Matchings found: %d" % count
                 ProblemInstance.print_matching(self.matching, '%s-all%d' % (output_filename, count))
                 count += 1
@@ -1466,7 +1440,6 @@ class ProblemInstance():
                     [-res_match[resident_dict[r_uid]][hospital_dict[self.matching[r_uid]]] for r_uid in self.matching]))
             else:
                 keep_searching = False
-                os.system('rm %s' % constraints_buffer_filename)
 
 
 SUFFIX_TABLE = {
@@ -1481,14 +1454,108 @@ FORMULATION_TABLE = {
     'mip': '.lp'
 }
 
+# the environment variable holding each solver's path, and what it must
+# point to
+SOLVER_PATH_TABLE = {
+    'sat': ('SAT_SOLVER_PATH', 'a SAT solver that reads the DIMACS input '
+            + 'format from standard input'),
+    'mip': ('CPLEX_PATH', 'CPLEX or another MIP solver that accepts CPLEX '
+            + 'input')
+}
 
-def main():
-    output_filename = None
+
+# solves one problem file for solve_problems(); problems solved in the same
+# process must not overlap, since agents are looked up by uid in
+# module-level registries whose entries each call to from_file overwrites
+def _solve_one(problem_filename, output_filename, solver, solver_path,
+               run_solver, verbose, enumerate_all, find_RPopt, cache_dir):
+    if cache_dir is None:
+        problem = ProblemInstance.from_file(problem_filename)
+    else:
+        problem = ProblemInstance.from_file_cached(problem_filename,
+                                                   cache_dir)
+    if solver == 'sat':
+        header = problem.solve_sat(solver=solver_path,
+                                   verbose=verbose,
+                                   run_solver=run_solver,
+                                   problem_name=problem_filename,
+                                   output_filename=output_filename,
+                                   enumerate_all=enumerate_all,
+                                   find_RPopt=find_RPopt,
+                                   cache_dir=cache_dir)
+    elif solver == 'mip':
+        header = problem.solve_mip(solver=solver_path,
+                                   verbose=verbose,
+                                   run_solver=run_solver,
+                                   problem_name=problem_filename,
+                                   output_filename=output_filename,
+                                   cache_dir=cache_dir)
+    if run_solver:
+        ProblemInstance.print_matching(problem.matching, output_filename,
+                                       header=header)
+
+
+# does what the command line does for a list of problem files, so that
+# driver scripts running many instances can import this module and call it
+# directly rather than starting a new process for each
+def solve_problems(problems, solver='sat', verbose=False, formulate=False,
+                   enumerate_all=False, find_RPopt=False, output=None,
+                   jobs=1, cache_dir=None):
     run_solver = True
+    if output and len(problems) > 1:
+        raise Exception("an output filename can only be given when "
+                        + "solving a single problem")
+    if jobs < 1:
+        raise Exception("the number of jobs must be at least 1")
+    if formulate:
+        run_solver = False
+    if enumerate_all and find_RPopt:
+        raise Exception("can't enumerate all stable matchings and " +
+                        "find an RPopt matching in a single run")
+    if solver == 'mip' and (enumerate_all or find_RPopt):
+        raise Exception("MIP enumeration or finding RPopt matching "
+                        + "not implemented")
+    if solver not in SOLVER_PATH_TABLE:
+        raise Exception('unknown solver: %s' % solver)
+    # read once here rather than at import, so that a driver script can
+    # still set the path after importing this module
+    variable, description = SOLVER_PATH_TABLE[solver]
+    solver_path = os.environ.get(variable)
+    if solver_path is None and run_solver:
+        raise Exception('%s must contain the path to %s'
+                        % (variable, description))
+    if output:
+        output_filenames = [output]
+    elif formulate:
+        output_filenames = [problem_filename + FORMULATION_TABLE[solver]
+                            for problem_filename in problems]
+    else:
+        output_filenames = [problem_filename + SUFFIX_TABLE[solver]
+                            for problem_filename in problems]
+    solve_one = functools.partial(
+        _solve_one, solver=solver, solver_path=solver_path,
+        run_solver=run_solver, verbose=verbose, enumerate_all=enumerate_all,
+        find_RPopt=find_RPopt, cache_dir=cache_dir)
+    if jobs > 1 and len(problems) > 1:
+        # each worker has its own copy of the agent registries
+        with multiprocessing.Pool(min(jobs, len(problems))) as pool:
+            pool.starmap(solve_one, zip(problems, output_filenames),
+                         chunksize=1)
+    else:
+        for problem_filename, output_filename in zip(problems,
+                                                     output_filenames):
+            solve_one(problem_filename, output_filename)
+
+
+def main():
+    # imported here so that importing this module for solve_problems does
+    # not pay for it
+    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        'problem',
-        help='the input problem file in the format described in the readme')
+        'problem', nargs='+',
+        help='the input problem file in the format described in the readme; '
+        + 'several files are solved in a single run')
     parser.add_argument(
         '-v', '--verbose',
         help='display more detail in problem formulation', action="store_true")
@@ -1506,47 +1573,21 @@ def main():
         '--find_RPopt',
         help='find an RPopt matching', action="store_true")
     parser.add_argument(
-        '-o', '--output', help='output filename')
+        '-o', '--output', help='output filename (single problem only)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of problem files to solve in parallel')
+    parser.add_argument(
+        '--cache_dir',
+        help='reuse parsed problems and solver results from earlier runs, '
+        + 'kept in this directory (solver results for MIP only when '
+        + 'solving through LP files)')
     args = parser.parse_args()
-    if not args.output and not args.formulate:
-        output_filename = args.problem + SUFFIX_TABLE[args.solver]
-    elif not args.output and args.formulate:
-        output_filename = args.problem + FORMULATION_TABLE[args.solver]
-    else:
-        output_filename = args.output
-    if args.formulate:
-        run_solver = False
-    if args.enumerate_all and args.find_RPopt:
-        raise Exception("can't enumerate all stable matchings and " +
-                        "find an RPopt matching in a single run")
-    if args.solver == 'mip' and (args.enumerate_all or args.find_RPopt):
-        raise Exception("MIP enumeration or finding RPopt matching "
-                        + "not implemented")
-    problem = ProblemInstance.from_file(args.problem)
-    if args.solver == 'sat':
-        solver_path = os.environ.get('SAT_SOLVER_PATH')
-        if solver_path is None and run_solver:
-            raise Exception(
-                'SAT_SOLVER_PATH must contain the path to a '
-                + 'SAT solver that accepts the DIMACS input format')
-        header = problem.solve_sat(solver=solver_path, verbose=args.verbose,
-                                   run_solver=run_solver,
-                                   problem_name=args.problem,
-                                   output_filename=output_filename,
-                                   enumerate_all=args.enumerate_all,
-                                   find_RPopt=args.find_RPopt)
-    elif args.solver == 'mip':
-        solver_path = os.environ.get('CPLEX_PATH')
-        if solver_path is None and run_solver:
-            raise Exception('CPLEX_PATH must contain the path to CPLEX or '
-                            + 'another MIP solver that accepts CPLEX input')
-        header = problem.solve_mip(solver=solver_path, verbose=args.verbose,
-                                   run_solver=run_solver,
-                                   problem_name=args.problem,
-                                   output_filename=output_filename)
-    if run_solver:
-        ProblemInstance.print_matching(problem.matching,
-                                       output_filename, header=header)
+    solve_problems(args.problem, solver=args.solver, verbose=args.verbose,
+                   formulate=args.formulate,
+                   enumerate_all=args.enumerate_all,
+                   find_RPopt=args.find_RPopt, output=args.output,
+                   jobs=args.jobs, cache_dir=args.cache_dir)
 
 if __name__ == "__main__":
     main()